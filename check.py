@@ -12,6 +12,7 @@ from rep_graph import mk_graph_slice, Hyp, eq_hyp, pc_true_hyp, pc_false_hyp
 import rep_graph
 from problem import Problem, consider_inline_c, inline_at_point
 
+import solver
 from solver import to_smt_expr
 from target_objects import functions, pairings, trace, printout
 import target_objects
@@ -538,13 +539,18 @@ def proof_checks_rec (p, restrs, hyps, proof, path):
 last_failed_check = [None]
 
 def proof_check_groups (checks):
+	"""the checks, grouped by the visits they mention. the groups
+	come in the order of the checks, so that runs are repeatable."""
 	groups = {}
+	order = []
 	for (hyps, hyp, name) in checks:
-		n_vcs = set ([n_vc for hyp2 in [hyp] + hyps
+		k = frozenset ([n_vc for hyp2 in [hyp] + hyps
 			for n_vc in hyp2.visits ()])
-		k = (tuple (sorted (list (n_vcs))))
-		groups.setdefault (k, []).append ((hyps, hyp, name))
-	return groups.values ()
+		if k not in groups:
+			groups[k] = []
+			order.append (k)
+		groups[k].append ((hyps, hyp, name))
+	return [groups[k] for k in order]
 
 def test_hyp_group (rep, group):
 	imps = [(hyps, hyp) for (hyps, hyp, _) in group]
@@ -576,6 +582,7 @@ save_checked_proofs = [None]
 def check_proof (p, proof, use_rep = None):
 	checks = proof_checks (p, proof)
 	groups = proof_check_groups (checks)
+	counts = dict (solver.smt_expr_cache_counts)
 
 	for group in groups:
 		if use_rep == None:
@@ -589,7 +596,9 @@ def check_proof (p, proof, use_rep = None):
 		(hyps, hyp, name) = elt
 		last_failed_check[0] = elt
 		trace ('%s: proof failed!' % name)
+		trace ('  (%s)' % solver.smt_expr_cache_summary (counts))
 		return False
+	trace ('  (%s)' % solver.smt_expr_cache_summary (counts))
 	if save_checked_proofs[0]:
 		save = save_checked_proofs[0]
 		save (p, proof)
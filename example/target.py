@@ -8,17 +8,19 @@
 
 from target_objects import target_dir, structs, functions, const_globals
 from target_objects import symbols, sections, rodata, pairings, danger_set
+import target_objects
 
 import syntax
 import objdump
 import logic
 
-f = open ('%s/Functions.txt' % target_dir)
-syntax.parse_and_install_all (f, None)
-f.close ()
+if not target_objects.snapshot_loaded[0]:
+	syntax.load_and_install_all ('%s/Functions.txt' % target_dir, None)
 
-print 'Checking.'
-syntax.check_funs (functions)
+	print 'Checking.'
+	syntax.check_funs (functions)
+
+	target_objects.save_snapshot (['Functions.txt'])
 
 #print 'Pseudo-Compiling.'
 #pseudo_compile.compile_funcs (functions)
@@ -50,6 +50,7 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 	trace (time.asctime ())
 	start_time = time.time()
 	sys.stdout.flush ()
+	prev_phase = solver.set_telemetry_phase ('problem')
 	try:
 		p = check.build_problem (pair)
 		if report:
@@ -57,15 +58,19 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 		if not check_loops and p.loop_data:
 			printout ('Problem has loop!')
 			tracer[0] = prev_tracer
+			solver.set_telemetry_phase (prev_phase)
 			return 'Loop'
 		if check_loops == 'only' and not p.loop_data:
 			printout ('No loop in problem.')
 			tracer[0] = prev_tracer
+			solver.set_telemetry_phase (prev_phase)
 			return 'NoLoop'
+		solver.set_telemetry_phase ('search')
 		proof = search.build_proof (p)
 		if report:
 			printout (' .. proof found.')
 
+		solver.set_telemetry_phase ('check')
 		try:
 			if report:
 				result = check.check_proof_report (p, proof)
@@ -78,6 +83,9 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 		except solver.SolverFailure, e:
 			printout ('Solver timeout/failure in proof check.')
 			result = 'CheckSolverFailure'
+		except solver.ReplayMiss, e:
+			printout ('Replay diverged in proof check: %s' % e.msg)
+			result = 'CheckReplayMiss'
 		except Exception, e:
 			trace ('EXCEPTION in checking %s:' % p.name)
 			exception = sys.exc_info ()
@@ -90,6 +98,9 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 	except solver.SolverFailure, e:
 		printout ('Solver timeout/failure in proof search.')
 		result = 'ProofSolverFailure'
+	except solver.ReplayMiss, e:
+		printout ('Replay diverged in proof search: %s' % e.msg)
+		result = 'ProofReplayMiss'
 
 	except Exception, e:
 		trace ('EXCEPTION in handling %s:' % pair)
@@ -98,6 +109,7 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 
 	end_time = time.time ()
 	tracer[0] = prev_tracer
+	solver.set_telemetry_phase (prev_phase)
 	if exception:
 		(etype, evalue, tb) = exception
 		traceback.print_exception (etype, evalue, tb,
@@ -106,7 +118,8 @@ def toplevel_check (pair, check_loops = True, report = False, count = None):
 	if not report:
 		printout ('Time taken to check %s for pair %s: %f'
 			% (result, pair, end_time - start_time))
-	elif result in ['ProofNoSplit', 'ProofEXCEPT', 'CheckEXCEPT']:
+	elif result in ['ProofNoSplit', 'ProofEXCEPT', 'CheckEXCEPT',
+			'ProofReplayMiss', 'CheckReplayMiss']:
 		printout ('Proof process failure (%s).' % result)
 	sys.stdout.flush ()
 
@@ -199,6 +212,40 @@ def main (args):
 				loops = 'only'
 			elif arg.startswith('save:'):
 				save_compiled_funcs (arg[5:])
+			elif arg.startswith ('solver-cache:'):
+				(_, s) = arg.split (':', 1)
+				solver.verdict_cache_dir[0] = s
+			elif arg == 'no-solver-cache':
+				solver.verdict_cache_dir[0] = None
+			elif arg == 'solver-portfolio':
+				solver.online_portfolio[0] = True
+			elif arg.startswith ('record-models:'):
+				(_, s) = arg.split (':', 1)
+				solver.model_response_log[0] = s
+			elif arg.startswith ('solver-telemetry:'):
+				(_, s) = arg.split (':', 1)
+				solver.telemetry_log[0] = s
+			elif arg.startswith ('adaptive-timeouts:'):
+				(_, s) = arg.split (':', 1)
+				solver.adaptive_timeout_history[0] = s
+			elif arg == 'slice-offline-queries':
+				solver.slice_offline_queries[0] = True
+			elif arg.startswith ('parallel-solvers:'):
+				(_, n) = arg.split (':', 1)
+				solver.max_parallel_solvers[0] = int (n)
+			elif arg.startswith ('save-smt-examples:'):
+				bits = arg.split (':', 2)
+				solver.save_solv_example_time[0] = float (bits[1])
+				if len (bits) > 2:
+					solver.solv_example_dir[0] = bits[2]
+			elif arg == 'lazy-rodata':
+				solver.lazy_rodata[0] = True
+			elif arg == 'phase-times':
+				for line in solver.phase_times_report ():
+					printout (line)
+			elif arg == 'mem-report':
+				for line in syntax.mem_report (functions):
+					printout (line)
 			elif arg.startswith('save-proofs:'):
 				fname = arg[len ('save-proofs:') :]
 				save = check.save_proofs_to_file (fname, 'a')
@@ -842,25 +842,37 @@ def entry_aligned_address (fun, radix):
 	return n
 
 def aligned_address_sanity (functions, symbols, radix):
+	"""check that each function starts at its symbol's address. functions
+	not loaded yet (see syntax.IndexedFunction) are checked when they are
+	loaded, failing with an AssertionError, as the targets assert this."""
+	def check_loaded (f, func):
+		assert aligned_address_sane (f, func, symbols, radix), f
 	for (f, func) in functions.iteritems ():
 		if f not in symbols:
 			# happens for static or invented functions sometimes
 			continue
-		if func.entry:
-			addr = first_aligned_address (func.nodes, radix)
-			if addr == None:
-				printout ('Warning: %s: no aligned instructions' % f)
-				continue
-			addr2 = symbols[f][0]
-			if addr != addr2:
-				printout ('target mismatch on func %s' % f)
-				printout ('  (starts at 0x%x not 0x%x)' % (addr, addr2))
-				return False
-			addr3 = entry_aligned_address (func, radix)
-			if addr3 != addr2:
-				printout ('entry mismatch on func %s' % f)
-				printout ('  (enters at 0x%x not 0x%x)' % (addr3, addr2))
-				return False
+		if not func.is_loaded ():
+			func.when_loaded (lambda func, f = f: check_loaded (f, func))
+		elif not aligned_address_sane (f, func, symbols, radix):
+			return False
+	return True
+
+def aligned_address_sane (f, func, symbols, radix):
+	if func.entry:
+		addr = first_aligned_address (func.nodes, radix)
+		if addr == None:
+			printout ('Warning: %s: no aligned instructions' % f)
+			return True
+		addr2 = symbols[f][0]
+		if addr != addr2:
+			printout ('target mismatch on func %s' % f)
+			printout ('  (starts at 0x%x not 0x%x)' % (addr, addr2))
+			return False
+		addr3 = entry_aligned_address (func, radix)
+		if addr3 != addr2:
+			printout ('entry mismatch on func %s' % f)
+			printout ('  (enters at 0x%x not 0x%x)' % (addr3, addr2))
+			return False
 	return True
 
 # variant of tarjan's strongly connected component algorithm
@@ -16,29 +16,31 @@ import objdump
 import logic
 import re
 
-f = open ('%s/loop-O1.elf.symtab' % target_dir)
-(lsymbs, lsects) = objdump.build_syms (f)
-f.close ()
-symbols.update (lsymbs)
-sections.update (lsects)
+inputs = ['loop-O1.elf.symtab', 'CFunDump.txt', 'ASMO1Funs.txt']
 
-f = open ('%s/CFunDump.txt' % target_dir)
-syntax.parse_and_install_all (f, 'C')
-f.close ()
+if not target_objects.snapshot_loaded[0]:
+	f = open ('%s/loop-O1.elf.symtab' % target_dir)
+	(lsymbs, lsects) = objdump.build_syms (f)
+	f.close ()
+	symbols.update (lsymbs)
+	sections.update (lsects)
 
-f = open ('%s/ASMO1Funs.txt' % target_dir)
-(astructs, afunctions, aconst_gs) = syntax.parse_and_install_all (f, 'ASM')
-f.close ()
-assert not astructs
-assert not aconst_gs
+	syntax.load_and_install_all ('%s/CFunDump.txt' % target_dir, 'C')
 
-assert logic.aligned_address_sanity (afunctions, symbols, 4)
+	(astructs, afunctions, aconst_gs) = syntax.load_and_install_all (
+		'%s/ASMO1Funs.txt' % target_dir, 'ASM')
+	assert not astructs
+	assert not aconst_gs
 
-print 'Pseudo-Compiling.'
-pseudo_compile.compile_funcs (functions)
+	assert logic.aligned_address_sanity (afunctions, symbols, 4)
 
-print 'Checking.'
-syntax.check_funs (functions)
+	print 'Pseudo-Compiling.'
+	pseudo_compile.compile_funcs (functions)
+
+	print 'Checking.'
+	syntax.check_funs (functions)
+
+	target_objects.save_snapshot (inputs)
 
 def asm_split_pairings ():
 	pairs = [(s, 'Loop.' + s) for s in ['f', 'g']]
@@ -374,10 +374,14 @@ def substitute_simple (func):
 		func.nodes[n] = node.subst_exprs (subst_expr,
 			ss = set (['Symbol', 'PAlignValid']))
 
+def compile_func (func):
+	substitute_simple (func)
+	check_compile (func)
+
 def compile_funcs (functions):
+	# functions which are not loaded yet are compiled when loaded
 	for (f, func) in functions.iteritems ():
-		substitute_simple (func)
-		check_compile (func)
+		func.when_loaded (compile_func)
 
 def combine_duplicate_nodes (nodes):
 	orig_size = len (nodes)
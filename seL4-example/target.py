@@ -16,30 +16,38 @@ import objdump
 import logic
 import re
 
-f = open ('%s/kernel.elf.symtab' % target_dir)
-(lsymbs, lsects) = objdump.build_syms (f)
-f.close ()
-symbols.update (lsymbs)
-sections.update (lsects)
+inputs = ['kernel.elf.symtab', 'CFunctions.txt', 'ASMFunctions.txt',
+	'kernel.elf.rodata']
 
-f = open ('%s/CFunctions.txt' % target_dir)
-syntax.parse_and_install_all (f, 'C')
-f.close ()
+# the parsed and pseudo-compiled functions etc may have been loaded from
+# a snapshot (see target_objects.save_snapshot)
+if not target_objects.snapshot_loaded[0]:
+	f = open ('%s/kernel.elf.symtab' % target_dir)
+	(lsymbs, lsects) = objdump.build_syms (f)
+	f.close ()
+	symbols.update (lsymbs)
+	sections.update (lsects)
 
-f = open ('%s/ASMFunctions.txt' % target_dir)
-(astructs, afunctions, aconst_globals) = syntax.parse_and_install_all (f, 'ASM')
-f.close ()
-assert not astructs
-assert not aconst_globals
+	syntax.load_and_install_all ('%s/CFunctions.txt' % target_dir, 'C')
 
-assert logic.aligned_address_sanity (afunctions, symbols, 4)
+	(astructs, afunctions, aconst_globals) = syntax.load_and_install_all (
+		'%s/ASMFunctions.txt' % target_dir, 'ASM')
+	assert not astructs
+	assert not aconst_globals
 
-f = open ('%s/kernel.elf.rodata' % target_dir)
-rodata[:] = objdump.build_rodata (f)
-f.close ()
+	assert logic.aligned_address_sanity (afunctions, symbols, 4)
 
-print 'Pseudo-Compiling.'
-pseudo_compile.compile_funcs (functions)
+	f = open ('%s/kernel.elf.rodata' % target_dir)
+	rodata[:] = objdump.build_rodata (f)
+	f.close ()
+
+	print 'Pseudo-Compiling.'
+	pseudo_compile.compile_funcs (functions)
+
+	print 'Checking.'
+	syntax.check_funs (functions)
+
+	target_objects.save_snapshot (inputs)
 
 def make_pairings ():
 	pairs = [(s, 'Kernel_C.' + s) for s in functions
@@ -52,7 +60,4 @@ def make_pairings ():
 
 make_pairings ()
 
-print 'Checking.'
-syntax.check_funs (functions)
-
 
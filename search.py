@@ -8,6 +8,7 @@
 
 import solver
 from solver import mk_smt_expr, to_smt_expr, smt_expr
+from solver import word_ops, word_ineq_ops, bool_ops, get_signed_val
 import check
 from check import restr_others, loops_to_split, ProofNode
 from rep_graph import (mk_graph_slice, vc_num, vc_offs, vc_upto,
@@ -47,9 +48,11 @@ last_proof = [None]
 
 def build_proof (p):
 	init_hyps = check.init_point_hyps (p)
+	counts = dict (solver.smt_expr_cache_counts)
 	proof = build_proof_rec (default_searcher, p, (), list (init_hyps))
 
 	trace ('Built proof for %s' % p.name)
+	trace ('  (%s)' % solver.smt_expr_cache_summary (counts))
 	printout (repr (proof))
 	last_proof[0] = proof
 
@@ -119,24 +122,6 @@ def expand_var_eqs (knowledge, (v_i, v_j)):
 		for pred in [mk_eq (pc_i, pc_j),
 			mk_implies (pc_i, logic.mk_eq_with_cast (v_i, v_j))]]
 
-word_ops = {'bvadd':lambda x, y: x + y, 'bvsub':lambda x, y: x - y,
-	'bvmul':lambda x, y: x * y, 'bvurem':lambda x, y: x % y,
-	'bvudiv':lambda x, y: x / y, 'bvand':lambda x, y: x & y,
-	'bvor':lambda x, y: x | y, 'bvxor': lambda x, y: x ^ y,
-	'bvnot': lambda x: ~ x, 'bvneg': lambda x: - x,
-	'bvshl': lambda x, y: x << y, 'bvlshr': lambda x, y: x >> y}
-
-bool_ops = {'=>':lambda x, y: (not x) or y, '=': lambda x, y: x == y,
-	'not': lambda x: not x, 'true': lambda: True, 'false': lambda: False}
-
-word_ineq_ops = {'=': (lambda x, y: x == y, 'Unsigned'),
-	'bvult': (lambda x, y: x < y, 'Unsigned'),
-	'word32-eq': (lambda x, y: x == y, 'Unsigned'),
-	'bvule': (lambda x, y: x <= y, 'Unsigned'),
-	'bvsle': (lambda x, y: x <= y, 'Signed'),
-	'bvslt': (lambda x, y: x < y, 'Signed'),
-}
-
 def eval_model (m, s, toplevel = None):
 	if s in m:
 		return m[s]
@@ -243,14 +228,6 @@ def eval_model (m, s, toplevel = None):
 	m[s] = result
 	return result
 
-def get_signed_val (x):
-	assert x.typ.kind == 'Word'
-	bits = x.typ.num
-	v = x.val & ((1 << bits) - 1)
-	if v >= (1 << (bits - 1)):
-		v = v - (1 << bits)
-	return v
-
 def short_array_str (arr):
 	items = [('%x: %x' % (p.val * 4, v.val))
 		for (p, v) in arr.iteritems ()
@@ -386,6 +363,26 @@ def debug_pair_eqs (knowledge, pair):
 
 	return (eqs, preds)
 
+def model_knowledge_exprs (knowledge, preds):
+	"""the expressions update_knowledge_for_model will evaluate in
+	a model, so only their values need be fetched."""
+	(_, _, (_, vs), _) = knowledge
+	exprs = list (preds)
+	mem_groups = {}
+	for v in vs:
+		exprs.extend ([x for (pc, val) in get_var_pc_var_list (knowledge, v)
+			for x in [pc, val]])
+		if v[0].typ == syntax.builtinTs['Mem']:
+			mem_groups.setdefault (vs[v][0], []).append (v)
+	# memory values are compared by split_group
+	for group in mem_groups.itervalues ():
+		for (i, v) in enumerate (group):
+			if vs[v][1]:
+				exprs.extend (expand_var_eqs (knowledge, (v, 'Const')))
+			for v2 in group[:i]:
+				exprs.extend (expand_var_eqs (knowledge, (v, v2)))
+	return exprs
+
 def add_model (knowledge, preds):
 	(rep, (_, _, _, premise), _, facts) = knowledge
 	if preds:
@@ -396,7 +393,7 @@ def add_model (knowledge, preds):
 		# ''all our predicates are true'' is trivially true. instead
 		# we must want a model (counterexample of false)
 		pred_expr = false_term
-	m = {}
+	m = solver.LazyModel (model_knowledge_exprs (knowledge, preds))
 	r = rep.solv.check_hyp (mk_implies (premise, pred_expr), {}, model = m)
 	if r == 'unsat':
 		if not preds:
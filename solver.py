@@ -10,7 +10,6 @@
 # which support SMTLIB2 push/pop and are controlled by pipe, and heavyweight
 # 'slow' solvers which are run once per problem on static input files.
 import signal
-# todo: support a collection of solvers running in parallel
 solverlist_missing = """
 This tool requires the use of an SMT solver.
 
@@ -30,7 +29,8 @@ CVC4: offline: /home/tsewell/bin/cvc4 --lang smt
 Z3 4.3: online: /home/tsewell/dev/z3-dist/build/z3 -t:2 -smt2 -in
 # Z3 4.3: offline: /home/tsewell/dev/z3-dist/build/z3 -smt2 -in
 
-N.B. only ONE online solver is needed, so Z3 is redundant in the above.
+N.B. only ONE online solver is needed, so Z3 is redundant in the above,
+unless the online solvers are run as a portfolio (see below).
 
 Each non-comment line is ':' separated, with this pattern:
 name : online/offline/fast/slow : command
@@ -44,8 +44,17 @@ The remainder of each line is a shell command that executes the solver in
 SMTLIB2 mode. For online solvers it is typically worth setting a resource
 limit, after which the offline solver will be run.
 
-The first online solver will be used. The offline solvers will be used in
-parallel, by default. The set to be used in parallel can be controlled with
+A command of the form 'record DIR COMMAND' runs the solver COMMAND but
+saves its responses in DIR, and 'replay DIR' answers from those responses
+without running any solver, e.g. for repeatable benchmarks:
+Z3: online: replay /tmp/transcripts
+The winners of races between solvers are also logged in DIR (races.txt)
+when recording, so a replay takes the same path as the recorded run.
+
+The first online solver will be used. In portfolio mode (the
+'solver-portfolio' option of graph-refine.py) every online solver is given
+each query and the first to answer sat/unsat is used. The offline solvers
+will be used in parallel, by default. The set to be used in parallel can be controlled with
 a strategy line e.g.:
 strategy: SONOLAR all, SONOLAR hyp, CVC4 hyp
 
@@ -61,6 +70,7 @@ class SolverImpl:
 		self.args = args
 		self.timeout = timeout
 		self.origname = name
+		self.transcript = None
 		if self.fast:
 			self.name = name + ' (online)'
 		else:
@@ -83,12 +93,23 @@ def parse_solver (bits):
 	name = bits[0]
 	fast = (bits[1].lower () in ['fast', 'online'])
 	args = bits[2].split ()
+	if args[0] in ['record', 'replay']:
+		# see solver_replay.py
+		script = os.path.join (os.path.dirname (
+			os.path.abspath (__file__)), 'solver_replay.py')
+		args = [sys.executable, script, args[0], args[1],
+			'%s %s' % (name, bits[1].lower ())] + args[2:]
+		if args[2] == 'record':
+			assert os.path.exists (args[5]), (args[5], bits)
 	assert os.path.exists (args[0]), (args[0], bits)
 	if not fast:
 		timeout = 6000
 	else:
 		timeout = 30
-	return SolverImpl (name, fast, args, timeout)
+	impl = SolverImpl (name, fast, args, timeout)
+	if bits[2].split ()[0] in ['record', 'replay']:
+		impl.transcript = bits[2].split ()[0]
+	return impl
 
 def get_solver_set ():
 	import os
@@ -149,14 +170,29 @@ def load_solver_set ():
 	strategy = [(slow_dict[nm], strat) for (nm, strat) in strategy]
 	assert fast_solvers, solvers
 	assert slow_solvers, solvers
-	return (fast_solvers[0], slow_solvers[0], strategy)
+	return (fast_solvers, slow_solvers[0], strategy)
 
-(fast_solver, slow_solver, strategy) = load_solver_set ()
+(fast_solvers, slow_solver, strategy) = load_solver_set ()
+fast_solver = fast_solvers[0]
+
+# the offline solvers raced to narrow unsat cores (see unsat_core_loop)
+unsat_solver_loop = [slow_solver] + [sv for (sv, _) in strategy
+	if sv != slow_solver]
+unsat_solver_loop = [sv for (i, sv) in enumerate (unsat_solver_loop)
+	if sv not in unsat_solver_loop[:i]]
+
+# after narrowing, try deleting batches of members from an unsat core,
+# testing the batches in parallel, for up to this many rounds.
+unsat_core_minimise_rounds = [20]
+
+# race every online solver on each query, rather than using just the first.
+online_portfolio = [False]
 
 from syntax import (Expr, fresh_name, builtinTs, true_term, false_term,
   foldr1, mk_or, boolT, word32T, word8T, mk_implies, Type, get_global_wrapper)
-from target_objects import structs, rodata, sections, trace
+from target_objects import structs, rodata, sections, symbols, trace
 from logic import mk_align_valid_ineq, pvalid_assertion1, pvalid_assertion2
+from logic import get_styp_condition_inner1
 
 import syntax
 import subprocess
@@ -166,7 +202,15 @@ import re
 import random
 import time
 import tempfile
+import array
+import collections
 import os
+import hashlib
+import threading
+import bisect
+import ctypes
+import ctypes.util
+import solver_replay
 
 last_solver = [None]
 last_10_models = []
@@ -175,19 +219,305 @@ last_check_model_state = [None]
 active_solvers = []
 max_active_solvers = [5]
 
+# the number of offline solvers parallel_test_hyps may keep running at
+# once. None means one per cpu.
+max_parallel_solvers = [None]
+
+def num_parallel_solvers ():
+	if max_parallel_solvers[0] != None:
+		return max_parallel_solvers[0]
+	import multiprocessing
+	return multiprocessing.cpu_count ()
+
+# online solver processes which have already loaded the common preamble
+# (init_replay), kept idle at the base assertion level. a new Solver
+# leases one and works above a (push 1) rather than starting afresh.
+solver_pool = {}
+solver_pool_size = [4]
+solver_pool_max_uses = [200]
+
+# replayable commands (declarations, definitions, assertions) are queued
+# and written to the online solver in batches of up to this size, with
+# the 'success' acknowledgements counted afterwards. the limit keeps the
+# acknowledgements well inside the pipe buffer. 1 disables batching.
+solver_batch_size = [200]
+
+# file to append the raw (get-value ..) responses to, e.g. for use with
+# 'python solver.py bench-sexp <file>'
+model_response_log = [None]
+
+# file to append one JSON row per solver event to, for use with
+# 'python solver.py report <file>'. the phase is set by the proof
+# search and check (see set_telemetry_phase).
+telemetry_log = [None]
+telemetry_phase = ['other']
+
+# time spent blocked waiting for solvers to answer, and wall time and
+# solver waiting time per phase, for separating the time the python side
+# takes from solver time (see phase_times_report).
+solver_wait_time = [0.0]
+phase_times = {}
+phase_start = [None]
+
+def set_telemetry_phase (phase):
+	prev = telemetry_phase[0]
+	now = (time.time (), solver_wait_time[0])
+	if phase_start[0] != None:
+		(start, wait) = phase_start[0]
+		[t, w] = phase_times.setdefault (prev, [0.0, 0.0])
+		phase_times[prev] = [t + now[0] - start, w + now[1] - wait]
+	phase_start[0] = now
+	telemetry_phase[0] = phase
+	return prev
+
+def phase_times_report ():
+	set_telemetry_phase (telemetry_phase[0])
+	lines = ['%-12s %10s %10s %10s' % ('phase', 'wall', 'solver',
+		'python')]
+	for (phase, (t, w)) in sorted (phase_times.items ()):
+		lines.append ('%-12s %10.2f %10.2f %10.2f' % (phase, t, w,
+			t - w))
+	return lines
+
+def note_solver_event (event, solver, strategy, hyps, script_bytes,
+		start, result, cpu = None):
+	if not telemetry_log[0]:
+		return
+	import json
+	row = {'event': event, 'solver': solver, 'strategy': strategy,
+		'phase': telemetry_phase[0], 'hyps': hyps,
+		'bytes': script_bytes, 'wall': time.time () - start,
+		'cpu': cpu, 'result': result, 'time': start,
+		'origin': query_origin ()}
+	f = open (telemetry_log[0], 'a')
+	f.write (json.dumps (row, sort_keys = True) + '\n')
+	f.close ()
+
 random_name = random.randrange (1, 10 ** 9)
 count = [0]
 
+# offline queries taking longer than save_solv_example_time seconds are
+# saved to the corpus in solv_example_dir, together with metadata (see
+# save_solv_example), for use with solver_corpus.py. -1 disables this.
 save_solv_example_time = [-1]
+solv_example_dir = ['smt_examples']
+
+# run offline queries first on a slice of the assertions relevant to
+# the goal (see Solver.sliced_script_prefix), confirming sat in full.
+slice_offline_queries = [False]
+
+smt_symbol_re = re.compile (r'[^\s()]+')
+
+# adaptive offline timeouts. with a history file set, the cpu time of each
+# offline query is recorded against its class (solver, origin, size) and
+# a new query is capped at a multiple of the learned percentile for its
+# class, between adaptive_timeout_min and the solver's own timeout. a
+# query hitting the cap fails as a timeout would, falling back as usual.
+adaptive_timeout_history = [None]
+adaptive_timeout_percentile = [0.95]
+adaptive_timeout_multiplier = [4.0]
+adaptive_timeout_min = [60]
+adaptive_timeout_min_samples = [20]
+adaptive_timeout_max_samples = [500]
+adaptive_timeout_samples = [None]
+
+# the functions a query may come from, innermost match taken as its origin
+query_origins = set (['find_split_limit', 'find_split', 'find_case_split',
+	'check_split_induct', 'check_split_induct_step_group',
+	'refute_minimise_vis_hyps', 'search_bin_bound',
+	'get_bound_super_ctxt_inner', 'find_unknown_recursion',
+	'test_hyp_group', 'check_proof_report_rec'])
+
+def query_origin ():
+	f = sys._getframe (1)
+	while f != None:
+		if f.f_code.co_name in query_origins:
+			return f.f_code.co_name
+		f = f.f_back
+	return 'other'
+
+def query_class (solver, script_bytes):
+	"""a query's class: solver, origin, and size (log2 of kbytes)."""
+	size = 0
+	kbytes = script_bytes >> 10
+	while kbytes:
+		size += 1
+		kbytes >>= 1
+	return (solver.origname, query_origin (), size)
+
+def adaptive_samples ():
+	if adaptive_timeout_samples[0] == None:
+		import json
+		samples = {}
+		fname = adaptive_timeout_history[0]
+		if os.path.exists (fname):
+			for l in open (fname):
+				try:
+					(qclass, t) = json.loads (l)
+				except ValueError:
+					continue
+				samples.setdefault (tuple (qclass), []).append (t)
+		adaptive_timeout_samples[0] = samples
+	return adaptive_timeout_samples[0]
+
+def adaptive_timeout (qclass, timeout):
+	if not adaptive_timeout_history[0] or timeout == None:
+		return timeout
+	samples = adaptive_samples ().get (qclass, [])
+	samples = samples[- adaptive_timeout_max_samples[0]:]
+	if len (samples) < adaptive_timeout_min_samples[0]:
+		return timeout
+	samples = sorted (samples)
+	i = int (adaptive_timeout_percentile[0] * (len (samples) - 1))
+	cap = int (samples[i] * adaptive_timeout_multiplier[0]) + 1
+	cap = max (cap, adaptive_timeout_min[0])
+	if cap < timeout:
+		trace ('capping %s query at %ds' % (qclass, cap))
+		return cap
+	return timeout
+
+def note_query_time (proc):
+	"""record the cpu time an offline solver process took (or hit its
+	cap at) in the history for its class."""
+	if not adaptive_timeout_history[0]:
+		return
+	import json
+	t = solver_cpu_time (proc)
+	if t == None:
+		t = time.time () - proc.query_start
+	adaptive_samples ().setdefault (proc.query_class, []).append (t)
+	f = open (adaptive_timeout_history[0], 'a')
+	f.write (json.dumps ([proc.query_class, t]) + '\n')
+	f.close ()
 
-def save_solv_example (solv, last_msgs, comments = []):
+def save_solv_example (solv, last_msgs, comments = [], meta = None,
+		prefix_len = None):
+	"""save a query to the corpus. the metadata (solver, strategy,
+	phase, origin, expected result, reference time etc) is saved
+	alongside in a .json file of the same name. prefix_len is the
+	number of replayable commands the query was made with, if the
+	solver has had more since."""
+	import json
 	count[0] += 1
 	name = 'ex_%d_%d' % (random_name, count[0])
-	f = open ('smt_examples/' + name, 'w')
+	dname = solv_example_dir[0]
+	if not os.path.isdir (dname):
+		os.makedirs (dname)
+	f = open (os.path.join (dname, name), 'w')
 	for msg in comments:
 		f.write ('; ' + msg + '\n')
-	solv.write_solv_script (f, last_msgs)
+	solv.write_solv_script (f, last_msgs, prefix_len = prefix_len)
+	f.close ()
+	if meta != None:
+		meta = dict (meta)
+		meta.setdefault ('phase', telemetry_phase[0])
+		meta.setdefault ('origin', query_origin ())
+		meta['saved'] = time.time ()
+		f = open (os.path.join (dname, name + '.json'), 'w')
+		f.write (json.dumps (meta, sort_keys = True) + '\n')
+		f.close ()
+	trace ('Saved slow query as %s.' % name)
+
+def maybe_save_solv_example (solv, cmds, solver, strategy, hyps,
+		start, response, prefix_len = None):
+	cutoff_time = save_solv_example_time[0]
+	t = time.time () - start
+	if cutoff_time == -1 or t <= cutoff_time:
+		return
+	save_solv_example (solv, cmds,
+		comments = ['reference time %s seconds' % t],
+		meta = {'solver': solver.origname, 'strategy': strategy,
+			'expected': response, 'reference_time': t,
+			'hyps': hyps}, prefix_len = prefix_len)
+
+# persistent cache of sat/unsat verdicts (and models) across runs, keyed
+# by a hash of the full query. set the directory to enable it.
+verdict_cache_dir = [None]
+verdict_cache_max_entries = [100000]
+verdict_cache_count = [None]
+verdict_cache_version = 'verdict-cache-1'
+
+def verdict_cache_path (key):
+	return os.path.join (verdict_cache_dir[0], key)
+
+def verdict_cache_lookup (key, model):
+	"""fetch a stored verdict, filling in model if one was stored.
+	returns None on a cache miss."""
+	path = verdict_cache_path (key)
+	try:
+		f = open (path)
+		lines = f.read ().splitlines ()
+		f.close ()
+	except IOError, e:
+		return None
+	if not lines or lines[0] not in ['sat', 'unsat']:
+		return None
+	m = {}
+	for line in lines[1:]:
+		(k, v) = line.split ('\t')
+		m[parse_s_expression (k)] = smt_to_val (v)
+	if model != None:
+		model.clear ()
+		model.update (m)
+	# note the use, eviction removes the least recently used
+	try:
+		os.utime (path, None)
+	except OSError, e:
+		pass
+	return lines[0]
+
+def verdict_cache_val (v):
+	if v == true_term:
+		return 'true'
+	elif v == false_term:
+		return 'false'
+	else:
+		assert v.kind == 'Num' and v.typ.kind == 'Word', v
+		return smt_num (v.val, v.typ.num)
+
+def verdict_cache_store (key, response, model):
+	if not os.path.isdir (verdict_cache_dir[0]):
+		os.makedirs (verdict_cache_dir[0])
+	lines = [response]
+	if model:
+		lines.extend (['%s\t%s' % (flat_s_expression (k),
+				verdict_cache_val (v))
+			for (k, v) in model.iteritems ()])
+	# write and rename, so parallel workers never see partial entries
+	(fd, name) = tempfile.mkstemp (dir = verdict_cache_dir[0],
+		prefix = 'tmp-')
+	f = os.fdopen (fd, 'w')
+	f.write ('\n'.join (lines) + '\n')
 	f.close ()
+	os.rename (name, verdict_cache_path (key))
+
+	if verdict_cache_count[0] == None:
+		verdict_cache_count[0] = len (os.listdir (verdict_cache_dir[0]))
+	verdict_cache_count[0] += 1
+	if verdict_cache_count[0] > verdict_cache_max_entries[0]:
+		verdict_cache_evict ()
+
+def verdict_cache_evict ():
+	"""drop the least recently used entries, leaving some headroom
+	so that eviction happens rarely."""
+	d = verdict_cache_dir[0]
+	ents = []
+	for name in os.listdir (d):
+		try:
+			ents.append ((os.path.getmtime (os.path.join (d, name)),
+				name))
+		except OSError, e:
+			pass
+	ents.sort ()
+	target = (verdict_cache_max_entries[0] * 9) / 10
+	drop = ents[: max (len (ents) - target, 0)]
+	for (_, name) in drop:
+		try:
+			os.remove (os.path.join (d, name))
+		except OSError, e:
+			pass
+	trace ('Evicted %d verdict cache entries.' % len (drop))
+	verdict_cache_count[0] = len (ents) - len (drop)
 
 smt_typ_builtins = {'Bool':'Bool', 'Mem':'{MemSort}', 'Dom':'{MemDomSort}',
 	'HTD':'HTDSort', 'PMS':'PMSSort'}
@@ -217,6 +547,154 @@ def smt_num (num, bits):
 	assert len (rep) == digs
 	return prefix + rep
 
+# the semantics of the SMT word and boolean operators, shared by the
+# constant folder (smt_fold) and search.eval_model.
+word_ops = {'bvadd':lambda x, y: x + y, 'bvsub':lambda x, y: x - y,
+	'bvmul':lambda x, y: x * y, 'bvurem':lambda x, y: x % y,
+	'bvudiv':lambda x, y: x / y, 'bvand':lambda x, y: x & y,
+	'bvor':lambda x, y: x | y, 'bvxor': lambda x, y: x ^ y,
+	'bvnot': lambda x: ~ x, 'bvneg': lambda x: - x,
+	'bvshl': lambda x, y: x << y, 'bvlshr': lambda x, y: x >> y}
+
+bool_ops = {'=>':lambda x, y: (not x) or y, '=': lambda x, y: x == y,
+	'not': lambda x: not x, 'true': lambda: True, 'false': lambda: False}
+
+word_ineq_ops = {'=': (lambda x, y: x == y, 'Unsigned'),
+	'bvult': (lambda x, y: x < y, 'Unsigned'),
+	'word32-eq': (lambda x, y: x == y, 'Unsigned'),
+	'bvule': (lambda x, y: x <= y, 'Unsigned'),
+	'bvsle': (lambda x, y: x <= y, 'Signed'),
+	'bvslt': (lambda x, y: x < y, 'Signed'),
+}
+
+def get_signed_val (x):
+	assert x.typ.kind == 'Word'
+	bits = x.typ.num
+	v = x.val & ((1 << bits) - 1)
+	if v >= (1 << (bits - 1)):
+		v = v - (1 << bits)
+	return v
+
+# fold ground terms (and trivial ifs, ands etc) in smt_expr, rather than
+# sending them to the solvers.
+smt_fold_constants = [True]
+
+def smt_literal_val (s):
+	if type (s) != str:
+		return None
+	if s in ['true', 'false'] or s.startswith ('#x') or s.startswith ('#b'):
+		return smt_to_val (s)
+	return None
+
+def smt_val_str (v):
+	if v == true_term:
+		return 'true'
+	elif v == false_term:
+		return 'false'
+	return smt_num (v.val, v.typ.num)
+
+def smt_fold_eval (op, xs):
+	"""the value of op applied to literal values xs, or None."""
+	if xs[0].typ.kind == 'Word' and op in word_ops:
+		if op in ['bvudiv', 'bvurem'] and xs[1].val == 0:
+			return None
+		bits = xs[0].typ.num
+		if op in ['bvshl', 'bvlshr'] and xs[1].val >= bits:
+			return Expr ('Num', xs[0].typ, val = 0)
+		v = word_ops[op] (* [x.val for x in xs])
+		return Expr ('Num', xs[0].typ, val = v & ((1 << bits) - 1))
+	elif xs[0].typ.kind == 'Word' and op in word_ineq_ops:
+		(oper, signed) = word_ineq_ops[op]
+		if signed == 'Signed':
+			v = oper (* map (get_signed_val, xs))
+		else:
+			v = oper (* [x.val for x in xs])
+		return {True: true_term, False: false_term}[v]
+	elif op in ['and', 'or'] or (op in bool_ops
+			and all ([x.typ == boolT for x in xs])):
+		bs = [x == true_term for x in xs]
+		if op == 'and':
+			v = all (bs)
+		elif op == 'or':
+			v = any (bs)
+		else:
+			v = bool_ops[op] (* bs)
+		return {True: true_term, False: false_term}[v]
+	return None
+
+def smt_fold_bool (op, vals):
+	"""simplify a boolean operator with some literal arguments."""
+	if op in ['and', 'or']:
+		(unit, zero) = {'and': ('true', 'false'),
+			'or': ('false', 'true')}[op]
+		if zero in vals:
+			return zero
+		vals = [v for v in vals if v != unit]
+		if not vals:
+			return unit
+		elif len (vals) == 1:
+			return vals[0]
+		return '(%s %s)' % (op, ' '.join (vals))
+	elif op == '=>':
+		[x, y] = vals
+		if x == 'false' or y == 'true':
+			return 'true'
+		elif x == 'true':
+			return y
+	elif op == 'not':
+		return {'(not true)': 'false', '(not false)': 'true'}.get (
+			'(not %s)' % vals[0])
+	return None
+
+def smt_fold (op, vals):
+	"""a simpler equivalent of the SMT term (op vals ..), or None."""
+	if not smt_fold_constants[0] or not vals:
+		return None
+	if [v for v in vals if type (v) != str]:
+		return None
+	lits = [smt_literal_val (v) for v in vals]
+	if None not in lits:
+		v = smt_fold_eval (op, lits)
+		if v != None:
+			return smt_val_str (v)
+	if op in ['and', 'or', '=>', 'not']:
+		return smt_fold_bool (op, vals)
+	elif op == 'ite':
+		[c, x, y] = vals
+		if c == 'true' or x == y:
+			return x
+		elif c == 'false':
+			return y
+	elif op in ['=', 'word32-eq', 'bvule', 'bvsle'] and vals[0] == vals[1]:
+		return 'true'
+	elif op in ['bvult', 'bvslt'] and vals[0] == vals[1]:
+		return 'false'
+	elif op in ['bvadd', 'bvsub', 'bvor', 'bvxor', 'bvshl', 'bvlshr'
+			] and lits[1] != None and lits[1].val == 0:
+		return vals[0]
+	elif op == 'bvadd' and lits[0] != None and lits[0].val == 0:
+		return vals[1]
+	elif op == 'bvadd' and lits[1] != None:
+		# (bvadd (bvadd x c1) c2) to (bvadd x (c1 + c2))
+		x = vals[0]
+		if not (x.startswith ('(bvadd ') and x.endswith (')')):
+			return None
+		bits = x[:-1].rsplit (' ', 1)
+		if ')' in bits[1]:
+			return None
+		c1 = smt_literal_val (bits[1])
+		if c1 == None or bits[0].count ('(') != bits[0].count (')') + 1:
+			return None
+		c = smt_fold_eval ('bvadd', [c1, lits[1]])
+		if c.val == 0:
+			return bits[0][len ('(bvadd ') :]
+		return '%s %s)' % (bits[0], smt_val_str (c))
+	return None
+
+def note_smt_fold (orig_size, sexp):
+	smt_expr_cache_counts['folded'] += 1
+	smt_expr_cache_counts['folded_bytes'] += orig_size - len (sexp)
+
 def mk_smt_expr (smt_expr, typ):
 	return Expr ('SMTExpr', typ, val = smt_expr)
 
@@ -225,15 +703,105 @@ class EnvMiss (Exception):
 		self.name = name
 		self.typ = typ
 
+# leave out the mem-dom facts (MemDom is translated as true). with this
+# off, add_pvalid_dom_assertions relates the pvalids to the domains.
 cheat_mem_doms = [True]
 
+# rather than define (rodata m) as the conjunction of the contents of every
+# word of .rodata, leave it uninterpreted and assert that it implies the
+# contents of the words each query reads (see add_rodata_assertions).
+lazy_rodata = [False]
+
+# the length from which a term translated by smt_expr is defined with
+# define-fun when first translated, and referred to by name thereafter
+smt_expr_share_len = [400]
+
+smt_expr_cache_counts = {'hit': 0, 'miss': 0, 'folded': 0,
+	'folded_bytes': 0}
+
 def smt_expr (expr, env, solv):
+	"""the SMT string (or SplitMem) for expr in env. translations of
+	operator expressions are cached per solver, keyed on the identity of
+	the expression and the values env gives its free variables. the
+	side effects of translation (model exprs, pvalids, defs) are all
+	recorded in the solver, so a repeated translation adds nothing."""
+	if expr.kind != 'Op' or solv == None:
+		return smt_expr_inner (expr, env, solv)
+	cache = getattr (solv, 'smt_expr_cache', None)
+	if cache == None:
+		return smt_expr_inner (expr, env, solv)
+	vs = smt_expr_free_vars (expr, solv)
+	if vs == None:
+		return smt_expr_inner (expr, env, solv)
+	k = (id (expr), tuple ([env.get (v) for v in vs]))
+	if k in cache:
+		smt_expr_cache_counts['hit'] += 1
+		return cache[k]
+	smt_expr_cache_counts['miss'] += 1
+	sexp = smt_expr_inner (expr, env, solv)
+	if (type (sexp) == str and len (sexp) >= smt_expr_share_len[0]
+			and expr.typ not in [builtinTs['HTD'], builtinTs['PMS']]):
+		sexp = solv.share_expr (sexp, expr.typ)
+	cache[k] = sexp
+	return sexp
+
+def smt_expr_free_vars (expr, solv):
+	"""the variables expr reads from its environment, or None if each
+	translation of it must be fresh (it invents a variable). memoised by
+	identity, keeping a reference to expr so its id is not reused."""
+	memo = solv.smt_expr_vars
+	k = id (expr)
+	if k in memo:
+		return memo[k][1]
+	if expr.kind == 'Var':
+		vs = ((expr.name, expr.typ), )
+	elif expr.kind == 'Invent' or expr.is_op ('HTDUpdate'):
+		vs = None
+	elif expr.kind == 'Op':
+		vs = set ()
+		for v in expr.vals:
+			v_vs = smt_expr_free_vars (v, solv)
+			if v_vs == None:
+				vs = None
+				break
+			vs.update (v_vs)
+		if vs != None:
+			vs = tuple (vs)
+	else:
+		vs = ()
+	memo[k] = (expr, vs)
+	return vs
+
+def smt_expr_cache_summary (since = None):
+	"""hit/miss counts of the smt_expr cache, and the terms removed by
+	smt_fold, optionally since an earlier snapshot of
+	smt_expr_cache_counts."""
+	counts = dict (smt_expr_cache_counts)
+	if since:
+		for k in since:
+			counts[k] -= since[k]
+	return ('smt_expr cache: %d hits, %d misses, %d terms folded'
+		' (%d bytes)' % (counts['hit'], counts['miss'],
+			counts['folded'], counts['folded_bytes']))
+
+def smt_expr_inner (expr, env, solv):
 	if expr.is_op (['WordCast', 'WordCastSigned']):
 		[v] = expr.vals
 		assert v.typ.kind == 'Word' and expr.typ.kind == 'Word'
 		ex = smt_expr (v, env, solv)
 		if expr.typ == v.typ:
 			return ex
+		if smt_fold_constants[0] and smt_literal_val (ex) != None:
+			lit = smt_literal_val (ex)
+			if expr.name == 'WordCast':
+				val = lit.val
+			else:
+				val = get_signed_val (lit)
+			sexp = smt_num (val & ((1 << expr.typ.num) - 1),
+				expr.typ.num)
+			note_smt_fold (len ('((_ zero_extend 00) )') + len (ex),
+				sexp)
+			return sexp
 		elif expr.typ.num < v.typ.num:
 			return '((_ extract %d 0) %s)' % (expr.typ.num - 1, ex)
 		else:
@@ -287,7 +855,7 @@ def smt_expr (expr, env, solv):
 		[p, dom] = [smt_expr (e, env, solv) for e in expr.vals]
 		md = '(%s %s %s)' % (smt_ops[expr.name], p, dom)
 		solv.note_mem_dom (p, dom, md)
-		if cheat_mem_doms:
+		if cheat_mem_doms[0]:
 			return 'true'
 		return md
 	elif expr.is_op ('MemUpdate'):
@@ -314,6 +882,10 @@ def smt_expr (expr, env, solv):
 	elif expr.is_op ('Equals') and expr.vals[0].typ == word32T:
 		(x, y) = [smt_expr (e, env, solv) for e in expr.vals]
 		sexp = '(word32-eq %s %s)' % (x, y)
+		folded = smt_fold ('word32-eq', [x, y])
+		if folded != None:
+			note_smt_fold (len (sexp), folded)
+			return folded
 		return sexp
 	elif expr.is_op ('StackEqualsImplies'):
 		[sp1, st1, sp2, st2] = [smt_expr (e, env, solv)
@@ -333,8 +905,17 @@ def smt_expr (expr, env, solv):
 		sp1 = smt_expr (sp1, env, solv)
 		sp2 = smt_expr (sp2, env, solv)
 		return '(and (= %s %s) %s)' % (sp1, sp2, eq)
+	elif expr.is_op ('ROData') and solv != None and solv.lazy_rodata:
+		[m] = expr.vals
+		m_s = smt_expr (m, env, solv)
+		solv.note_rodata_mem (m_s)
+		return '(rodata %s)' % m_s
 	elif expr.is_op ('IfThenElse'):
 		(sw, x, y) = [smt_expr (e, env, solv) for e in expr.vals]
+		folded = smt_fold ('ite', [sw, x, y])
+		if folded != None:
+			note_smt_fold (len (sw) + len (x) + len (y) + 8, folded)
+			return folded
 		return smt_ifthenelse (sw, x, y, solv)
 	elif expr.is_op ('HTDUpdate'):
 		var = solv.add_var ('updated_htd', expr.typ)
@@ -343,11 +924,18 @@ def smt_expr (expr, env, solv):
 		vals = [smt_expr (e, env, solv) for e in expr.vals]
 		if vals:
 			sexp = '(%s %s)' % (smt_ops[expr.name], ' '.join(vals))
+			folded = smt_fold (smt_ops[expr.name], vals)
+			if folded != None:
+				note_smt_fold (len (sexp), folded)
+				return folded
 		else:
 			sexp = smt_ops[expr.name]
 		maybe_note_model_expr (sexp, expr.typ, expr.vals, solv)
 		return sexp
 	elif expr.kind == 'Num':
+		if expr.val < 0 and smt_fold_constants[0]:
+			return smt_num (expr.val & ((1 << expr.typ.num) - 1),
+				expr.typ.num)
 		return smt_num (expr.val, expr.typ.num)
 	elif expr.kind == 'Var':
 		if (expr.name, expr.typ) not in env:
@@ -376,6 +964,8 @@ def smt_expr_memacc (m, p, typ, solv):
 		sexp = '(load-word%d %s %s)' % (typ.num, m, p)
 	else:
 		assert not 'word load type supported'
+	if solv != None:
+		solv.note_rodata_read (p, typ.num)
 	solv.note_model_expr (sexp, typ)
 	return sexp
 
@@ -545,22 +1135,216 @@ preamble = mem_word32_preamble
 smt_convs = {'MemSort': '(Array (_ BitVec 30) (_ BitVec 32))',
 	'MemDomSort': '(Array (_ BitVec 32) (_ BitVec 1))'}
 
-def preexec (timeout):
+def preexec (timeout, lifetime = None):
+	"""set up a solver process. it may use timeout cpu seconds, or
+	for a pooled process, whose (soft) limit is reset for each lease
+	(see reset_cpu_limit), up to lifetime seconds in all."""
 	def ret ():
 		# setting the session ID on a fork allows us to clean up
 		# the resulting process group, useful if running multiple
 		# solvers in parallel.
 		os.setsid ()
 		if timeout != None:
+			hard = timeout
+			if lifetime != None:
+				hard = max (timeout, lifetime)
 			resource.setrlimit(resource.RLIMIT_CPU,
-				(timeout, timeout))
+				(timeout, hard))
 	return ret
 
+class RLimit (ctypes.Structure):
+	_fields_ = [('rlim_cur', ctypes.c_ulong), ('rlim_max', ctypes.c_ulong)]
+
+libc = [None]
+
+def prlimit_cpu (proc, limits = None):
+	"""the (soft, hard) cpu rlimit of a solver process, after setting
+	it to limits if given. None if this platform can't do that."""
+	if libc[0] == None:
+		try:
+			libc[0] = ctypes.CDLL (ctypes.util.find_library ('c'),
+				use_errno = True)
+			libc[0].prlimit
+		except (OSError, AttributeError), e:
+			libc[0] = False
+	if not libc[0]:
+		return None
+	new = None
+	if limits != None:
+		new = ctypes.byref (RLimit (* limits))
+	old = RLimit ()
+	if libc[0].prlimit (proc.pid, resource.RLIMIT_CPU, new,
+			ctypes.byref (old)) != 0:
+		return None
+	if limits != None:
+		return limits
+	return (old.rlim_cur, old.rlim_max)
+
+def solver_cpu_time (proc):
+	"""cpu seconds used so far by a solver process, or None if
+	this platform doesn't tell us."""
+	if proc == None:
+		return None
+	try:
+		stat = open ('/proc/%d/stat' % proc.pid).read ()
+	except IOError:
+		return None
+	# utime and stime are fields 14 and 15, after the (comm) field
+	bits = stat.rsplit (')', 1)[1].split ()
+	ticks = int (bits[11]) + int (bits[12])
+	return ticks / float (os.sysconf ('SC_CLK_TCK'))
+
+def solver_worn_out (proc, uses, impl):
+	"""pooled processes accumulate cpu time against the rlimit set
+	by preexec. each lease resets the limit to give the full budget of
+	a fresh process (see reset_cpu_limit), so a process is retired once
+	its lifetime limit no longer leaves room for that."""
+	if uses >= solver_pool_max_uses[0]:
+		return True
+	if impl.transcript:
+		# the process is solver_replay.py, whose cpu time would
+		# differ between recording and replay
+		return False
+	if impl.timeout == None:
+		return False
+	cpu = solver_cpu_time (proc)
+	limits = prlimit_cpu (proc)
+	if cpu == None or limits == None:
+		# the limit can't be reset for the next lease
+		return True
+	return int (cpu) + 1 + impl.timeout > limits[1]
+
+def reset_cpu_limit (proc, impl):
+	"""give a pooled process impl.timeout cpu seconds from now, as
+	a fresh process has. returns False if that can't be done."""
+	if impl.timeout == None or impl.transcript:
+		return True
+	cpu = solver_cpu_time (proc)
+	limits = prlimit_cpu (proc)
+	if cpu == None or limits == None:
+		return False
+	# rlimits are whole seconds, so the part second used is added
+	soft = int (cpu) + 1 + impl.timeout
+	if soft > limits[1]:
+		return False
+	return prlimit_cpu (proc, (soft, limits[1])) != None
+
+def close_solver_process (proc):
+	try:
+		proc.stdin.close ()
+	except IOError, e:
+		# the solver has gone, leaving input unflushed
+		pass
+	proc.stdout.close ()
+
+def lease_pooled_solver (key, impl):
+	procs = solver_pool.get (key, [])
+	while procs:
+		(proc, uses) = procs.pop ()
+		if proc.poll () == None and reset_cpu_limit (proc, impl):
+			return (proc, uses)
+		close_solver_process (proc)
+	return None
+
+def return_pooled_solver (key, impl, proc, uses):
+	"""rewind a solver process to the base assertion level and pool
+	it. returns False if the process isn't fit to be reused."""
+	procs = solver_pool.setdefault (key, [])
+	if len (procs) >= solver_pool_size[0]:
+		return False
+	if solver_worn_out (proc, uses, impl):
+		return False
+	try:
+		proc.stdin.write ('(get-info :assertion-stack-levels)\n')
+		proc.stdin.flush ()
+		levels = get_s_expression (proc.stdout,
+			'(get-info :assertion-stack-levels)')
+		if (len (levels) != 2 or levels[0] != ':assertion-stack-levels'
+				or not levels[1].isdigit ()):
+			return False
+		if int (levels[1]) > 0:
+			proc.stdin.write ('(pop %s)\n' % levels[1])
+			proc.stdin.flush ()
+			if proc.stdout.readline ().strip () != 'success':
+				return False
+	except (IOError, ConversationProblem, ReplayMiss), e:
+		return False
+	procs.append ((proc, uses))
+	return True
+
+def write_solver_input (stream, chunks):
+	"""feed an offline solver its input (run in a separate thread,
+	since the input can be much larger than the pipe buffer)."""
+	try:
+		for chunk in chunks:
+			stream.write (chunk)
+		stream.close ()
+	except IOError, e:
+		# the solver was stopped before reading everything
+		pass
+
 class ConversationProblem (Exception):
 	def __init__ (self, prompt, response):
 		self.prompt = prompt
 		self.response = response
 
+class ReplayMiss (Exception):
+	"""a replayed solver (see solver_replay.py) was asked something
+	it wasn't asked when the conversation was recorded."""
+	def __init__ (self, msg):
+		self.msg = msg
+
+	def __str__ (self):
+		return 'ReplayMiss (%r)' % self.msg
+
+# races between solvers (portfolio queries and parallel offline queries)
+# are won by whichever answers first, which a replay can't reproduce. the
+# winners are logged with the transcripts in record mode, and followed in
+# replay mode.
+race_log_name = 'races.txt'
+race_logs = {}
+
+def race_log_mode (impls):
+	"""the transcript mode and directory shared by some racing
+	solvers, or (None, None)."""
+	modes = set ([(impl.transcript, impl.transcript and impl.args[3])
+		for impl in impls])
+	if len (modes) != 1:
+		return (None, None)
+	return list (modes)[0]
+
+def note_race_winner (impls, race, winner):
+	(mode, dname) = race_log_mode (impls)
+	if mode != 'record':
+		return
+	if dname not in race_logs:
+		race_logs[dname] = open (os.path.join (dname,
+			race_log_name), 'w')
+	race_logs[dname].write ('%s %s\n' % (race, winner))
+	race_logs[dname].flush ()
+
+def recorded_race_winner (impls, race):
+	"""the next winner from the race log in replay mode, or None if
+	the solvers aren't being replayed."""
+	(mode, dname) = race_log_mode (impls)
+	if mode != 'replay':
+		return None
+	if dname not in race_logs:
+		fname = os.path.join (dname, race_log_name)
+		log = []
+		if os.path.exists (fname):
+			log = [l.rstrip ('\n') for l in open (fname)]
+		log.reverse ()
+		race_logs[dname] = log
+	log = race_logs[dname]
+	if not log:
+		raise ReplayMiss ('no recorded winner of %s race' % race)
+	(race2, winner) = log.pop ().split (' ', 1)
+	if race2 != race:
+		raise ReplayMiss ('recorded winner of %s race, not %s'
+			% (race2, race))
+	return winner
+
 def get_s_expression (stream, prompt):
 	try:
 		return get_s_expression_inner (stream, prompt)
@@ -568,28 +1352,92 @@ def get_s_expression (stream, prompt):
 		raise ConversationProblem (prompt, 'IOError')
 
 def get_s_expression_inner (stdout, prompt):
-	"""retreives responses from a solver until parens match"""
+	"""retreives responses from a solver until parens match,
+	tokenising each line as it arrives"""
 	responses = [stdout.readline ().strip ()]
 	if not responses[0].startswith ('('):
 		bits = responses[0].split ()
 		if len (bits) != 1:
 			raise ConversationProblem (prompt, responses[0])
 		return bits[0]
-	lpars = responses[0].count ('(')
-	rpars = responses[0].count (')')
+	bits = s_expression_re.findall (responses[0])
+	depth = bits.count ('(') - bits.count (')')
 	emps = 0
-	while rpars < lpars:
+	while depth > 0:
 		r = stdout.readline ().strip ()
 		responses.append (r)
-		lpars += r.count ('(')
-		rpars += r.count (')')
+		new_bits = s_expression_re.findall (r)
+		depth += new_bits.count ('(') - new_bits.count (')')
+		bits.extend (new_bits)
 		if r == '':
 			emps += 1
 			if emps >= 3:
 				raise ConversationProblem (prompt, responses)
 		else:
 			emps = 0
-	return parse_s_expressions (responses)
+	return parse_s_expression_bits (bits)
+
+class SolverOutput:
+	"""the output pipe of a solver process, read in large chunks.
+	reading the pipe itself line by line costs a system call per
+	character, which is slow for large models. only the lines asked
+	for are consumed, so commands can still be pipelined."""
+	def __init__ (self, f):
+		self.f = f
+		self.fd = f.fileno ()
+		self.buf = ''
+		self.pos = 0
+		self.eof = False
+
+	def fileno (self):
+		return self.fd
+
+	def has_line (self):
+		"""whether readline can return without reading the pipe.
+		check this before waiting on the pipe with select."""
+		return (self.buf.find ('\n', self.pos) >= 0
+			or (self.eof and self.pos < len (self.buf)))
+
+	def readline (self):
+		line = self.readline_inner ()
+		if line.startswith (solver_replay.miss_response):
+			raise ReplayMiss (line.strip ())
+		return line
+
+	def readline_inner (self):
+		if self.f.closed:
+			raise ValueError ('I/O operation on closed file')
+		while True:
+			i = self.buf.find ('\n', self.pos)
+			if i >= 0:
+				line = self.buf[self.pos : i + 1]
+				self.pos = i + 1
+				return line
+			if self.eof:
+				line = self.buf[self.pos:]
+				self.pos = len (self.buf)
+				return line
+			start = time.time ()
+			try:
+				chunk = os.read (self.fd, 65536)
+			except OSError, e:
+				raise IOError (e.errno, e.strerror)
+			finally:
+				solver_wait_time[0] += time.time () - start
+			if not chunk:
+				self.eof = True
+			self.buf = self.buf[self.pos:] + chunk
+			self.pos = 0
+
+	def close (self):
+		self.f.close ()
+
+def start_solver_process (args, timeout, lifetime = None):
+	proc = subprocess.Popen (args,
+		stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+		preexec_fn = preexec (timeout, lifetime), close_fds = True)
+	proc.stdout = SolverOutput (proc.stdout)
+	return proc
 
 class SolverFailure(Exception):
 	def __init__ (self, msg):
@@ -598,21 +1446,157 @@ class SolverFailure(Exception):
 	def __str__ (self):
 		return 'SolverFailure (%r)' % self.msg
 
+# the last few commands written to each online solver are kept in a ring
+# buffer of this size, for debugging. 0 keeps none.
+solver_written_history = [64]
+
+# the common preambles (init_replay) of the solvers, shared by hash
+init_replays = {}
+
+class ReplayLog:
+	"""the replayable commands of a solver, (msg, is_model) pairs, kept
+	in an append-only temporary file with an index of their offsets in
+	memory. a solver's commands are only needed again when a solver
+	process is restarted or an offline script written, and keeping them
+	all in memory for each live solver limited the size of the problems
+	which could be tackled. truncating the log only drops commands from
+	the index, so a span of the file (see span) never changes, and can
+	be streamed to an offline solver while more commands are logged."""
+	chunk = 1024
+	chunk_bytes = 1 << 20
+
+	def __init__ (self):
+		self.f = None
+		self.size = 0
+		self.starts = array.array ('l')
+		self.ends = array.array ('l')
+		self.flags = array.array ('b')
+		# the file position is shared by writers and offline solver
+		# input threads (see write_solver_input)
+		self.lock = threading.Lock ()
+
+	def __len__ (self):
+		return len (self.flags)
+
+	def append (self, (msg, is_model)):
+		with self.lock:
+			if self.f == None:
+				self.f = tempfile.TemporaryFile (
+					prefix = 'graph-refine-')
+			self.f.seek (self.size)
+			self.f.write (msg + '\n')
+		self.starts.append (self.size)
+		self.size += len (msg) + 1
+		self.ends.append (self.size)
+		self.flags.append (bool (is_model))
+
+	def truncate (self, n):
+		del self.starts[n:]
+		del self.ends[n:]
+		del self.flags[n:]
+
+	def read (self, start, end):
+		"""the bytes of the file from start to end."""
+		with self.lock:
+			self.f.flush ()
+			self.f.seek (start)
+			return self.f.read (end - start)
+
+	def span (self, start = 0, end = None):
+		"""the commands from start to end, one per line, as a
+		ReplayLogSpan of the file."""
+		if end == None:
+			end = len (self)
+		runs = []
+		for k in range (start, end):
+			if runs and runs[-1][1] == self.starts[k]:
+				runs[-1][1] = self.ends[k]
+			else:
+				runs.append ([self.starts[k], self.ends[k]])
+		return ReplayLogSpan (self, runs)
+
+	def text (self, start = 0, end = None):
+		"""the commands from start to end, one per line."""
+		return ''.join (self.span (start, end))
+
+	def iter_range (self, start = 0, end = None):
+		if end == None:
+			end = len (self)
+		for i in range (start, end, self.chunk):
+			j = min (i + self.chunk, end)
+			base = self.starts[i]
+			data = self.read (base, self.ends[j - 1])
+			for k in range (i, j):
+				msg = data[self.starts[k] - base
+					: self.ends[k] - base - 1]
+				yield (msg, bool (self.flags[k]))
+
+	def __iter__ (self):
+		return self.iter_range ()
+
+	def __getitem__ (self, k):
+		if isinstance (k, slice):
+			(start, end, step) = k.indices (len (self))
+			assert step == 1, k
+			return list (self.iter_range (start, end))
+		if k < 0:
+			k += len (self)
+		return list (self.iter_range (k, k + 1))[0]
+
+class ReplayLogSpan:
+	"""some byte ranges of a ReplayLog's file, read in chunks of at
+	most chunk_bytes when iterated over."""
+	def __init__ (self, log, runs):
+		self.log = log
+		self.runs = runs
+
+	def __len__ (self):
+		return sum ([end - start for (start, end) in self.runs])
+
+	def __iter__ (self):
+		for (start, end) in self.runs:
+			for i in range (start, end, self.log.chunk_bytes):
+				yield self.log.read (i,
+					min (end, i + self.log.chunk_bytes))
+
+def script_chunks (parts):
+	"""the text of an offline solver script given as strings and
+	ReplayLogSpans, in chunks."""
+	for part in parts:
+		if type (part) == str:
+			yield part
+		else:
+			for chunk in part:
+				yield chunk
+
+def script_len (parts):
+	return sum ([len (part) for part in parts])
+
 class Solver:
 	def __init__ (self, produce_unsat_cores = False):
 		self.replayable = []
 		self.init_replay = []
 		self.unsat_cores = produce_unsat_cores
 		self.online_solver = None
+		self.online_pool_key = None
+		self.online_uses = 0
 		self.parallel_solvers = {}
+		self.parallel_solver_starts = {}
+		self.parallel_solver_cmds = {}
+		self.portfolio_solvers = {}
+		self.pending_sends = []
+		self.pending_base = None
 
 		self.names_used = {}
-		self.names_used_order = []
 		self.external_names = {}
 		self.name_ext = ''
 		self.pvalids = {}
+		self.pvalid_index = {}
+		self.pvalid_dom_facts = set ()
 		self.ptrs = {}
 		self.cached_exprs = {}
+		self.smt_expr_cache = {}
+		self.smt_expr_vars = {}
 		self.defs = {}
 		self.doms = set ()
 		self.model_vars = set ()
@@ -621,12 +1605,27 @@ class Solver:
 		self.stack_eqs = {}
 		self.mem_naming = {}
 
-		self.written = []
+		self.written = collections.deque (
+			maxlen = solver_written_history[0])
+		self.slice_index = None
 		self.num_hyps = 0
+		self.replay_hash = hashlib.sha1 (verdict_cache_version)
+		self.init_replay_hash = None
 
 		self.pvalid_doms = None
 
+		self.lazy_rodata = lazy_rodata[0] and '.rodata' in sections
+		self.rodata_mems = []
+		self.rodata_reads = [('Witness', None)]
+		self.rodata_reads_set = set ()
+		self.rodata_facts_done = (0, 0)
+		self.rodata_table = None
+		self.rodata_table_words = set ()
+		self.rodata_objects = None
+		self.rodata_fallbacks = 0
+
 		self.fast_solver = fast_solver
+		self.fast_solvers = fast_solvers
 		self.slow_solver = slow_solver
 		self.strategy = strategy
 
@@ -644,9 +1643,11 @@ class Solver:
 
 		self.add_rodata_def ()
 
-		self.init_replay = self.replayable
-		self.init_replay = [msg for (msg, _) in self.init_replay]
-		self.replayable = []
+		self.init_replay_hash = self.replay_hash.hexdigest ()
+		self.init_replay = init_replays.setdefault (
+			self.init_replay_hash,
+			[msg for (msg, _) in self.replayable])
+		self.replayable = ReplayLog ()
 
 		last_solver[0] = self
 
@@ -660,26 +1661,62 @@ class Solver:
 			solver = use_this_solver
 		else:
 			solver = self.fast_solver
-		self.online_solver = subprocess.Popen (solver.args,
-			stdin = subprocess.PIPE, stdout = subprocess.PIPE,
-			preexec_fn = preexec (solver.timeout))
-
-		self.written = []
-
-		for msg in self.init_replay:
-			self.send (msg, replay=False)
-		for (msg, _) in self.replayable:
+		key = (tuple (solver.args), self.init_replay_hash)
+		self.online_pool_key = (key, solver)
+		self.written.clear ()
+		# queued commands are left for flush_sends, after the replay
+		pending = self.pending_sends
+		self.pending_sends = []
+		replayable = self.replayable.iter_range ()
+		if pending:
+			replayable = self.replayable.iter_range (0,
+				self.pending_base[0])
+		try:
+			self.startup_replay (key, solver, replayable)
+		finally:
+			self.pending_sends = pending
+
+	def startup_replay (self, key, solver, replayable):
+		leased = lease_pooled_solver (key, solver)
+		if leased:
+			(self.online_solver, self.online_uses) = leased
+		else:
+			# the hard limit caps the cpu the process may use over
+			# all its leases from the pool
+			lifetime = None
+			if solver.timeout != None:
+				lifetime = solver.timeout * solver_pool_max_uses[0]
+			self.online_solver = start_solver_process (solver.args,
+				solver.timeout, lifetime = lifetime)
+			self.online_uses = 0
+			for msg in self.init_replay:
+				self.send (msg, replay=False)
+
+		self.send ('(push 1)', replay=False)
+		for (msg, _) in replayable:
 			self.send (msg, replay=False)
 
-	def close (self):
+	def close (self, reuse = True):
 		self.close_parallel_solvers ()
+		for (proc, _) in self.portfolio_solvers.values ():
+			proc.stdin.close ()
+			proc.stdout.close ()
+		self.portfolio_solvers = {}
 		if self.online_solver:
-			self.online_solver.stdin.close()
-			self.online_solver.stdout.close()
+			proc = self.online_solver
 			self.online_solver = None
+			(key, solver) = self.online_pool_key
+			# a portfolio loser still busy with a query isn't pooled
+			if not (reuse and self.settle_portfolio_loser (solver,
+						proc, False)
+					and return_pooled_solver (key, solver,
+						proc, self.online_uses + 1)):
+				proc.stdin.close ()
+				proc.stdout.close ()
 
 	def __del__ (self):
-		self.close ()
+		# module globals (incl. the pool) may be gone at exit
+		self.close (reuse = solver_pool != None)
 
 	def smt_name (self, name, kind = ('Var', None),
 			ignore_external_names = False):
@@ -687,15 +1724,24 @@ class Solver:
 		if not ignore_external_names:
 			name = fresh_name (name, self.external_names)
 		name = fresh_name (name, self.names_used, kind)
-		self.names_used_order.append (name)
 		return name
 
 	def write (self, msg):
+		if getattr (self.online_solver, 'portfolio_pending', 0):
+			if not self.settle_portfolio_loser (self.fast_solver,
+					self.online_solver, True):
+				raise IOError ('portfolio solver dropped')
 		self.online_solver.stdin.write (msg + '\n')
 		self.written.append (msg)
 		self.online_solver.stdin.flush()
 
 	def send_inner (self, msg, replay = True, is_model = True):
+		if self.collecting_preamble ():
+			msg = msg.format (** smt_convs)
+			self.replayable.append ((msg, is_model))
+			self.replay_hash.update (msg + '\n')
+			return
+		self.flush_sends ()
 		if self.online_solver == None:
 			self.startup_solver ()
 
@@ -712,11 +1758,19 @@ class Solver:
 			raise ConversationProblem (msg, response)
 		if replay:
 			self.replayable.append((msg, is_model))
+			self.replay_hash.update (msg + '\n')
+
+	def collecting_preamble (self):
+		"""the common preamble is collected during __init__ and only
+		sent when a solver process is started, so that a process
+		which already has it loaded can be taken from the pool."""
+		return self.init_replay_hash == None
 
 	def solver_loop (self, attempt):
 		err = None
 		for i in range (5):
-			if self.online_solver == None:
+			if (self.online_solver == None
+					and not self.collecting_preamble ()):
 				self.startup_solver ()
 			try:
 				return attempt ()
@@ -726,19 +1780,86 @@ class Solver:
 				trace ('I sent %r' % e.prompt)
 				trace ('I got %r' % e.response)
 				trace ('restarting solver')
+				if self.online_solver != None:
+					close_solver_process (self.online_solver)
 				self.online_solver = None
 				err = (e.prompt, e.response)
 		trace ('Repeated SMT failure, giving up.')
 		raise ConversationProblem (err[0], err[1])
 
 	def send (self, msg, replay = True, is_model = True):
+		if (replay and solver_batch_size[0] > 1
+				and not self.collecting_preamble ()):
+			self.queue_send (msg, is_model)
+			return
 		self.solver_loop (lambda: self.send_inner (msg,
 			replay = replay, is_model = is_model))
 
+	def queue_send (self, msg, is_model):
+		"""queue a replayable command. it goes into replayable (and
+		the replay hash) straight away, and is withdrawn again if the
+		solver rejects it."""
+		msg = msg.format (** smt_convs)
+		for line in msg.splitlines():
+			trace ('to smt%s %s' % (self.name_ext, line))
+		if not self.pending_sends:
+			self.pending_base = (len (self.replayable),
+				self.replay_hash.copy ())
+		self.pending_sends.append ((msg, is_model))
+		self.replayable.append ((msg, is_model))
+		self.replay_hash.update (msg + '\n')
+		if len (self.pending_sends) >= solver_batch_size[0]:
+			self.flush_sends ()
+
+	def flush_sends (self):
+		"""write the queued commands in one go, then count off their
+		acknowledgements. if anything goes wrong the batch is sent
+		again one command at a time, so that errors are reported
+		against the command which caused them."""
+		if not self.pending_sends:
+			return
+		batch = self.pending_sends
+		self.pending_sends = []
+		# withdraw the batch until the solver has accepted it
+		(n, h) = self.pending_base
+		self.replayable.truncate (n)
+		self.replay_hash = h
+		self.slice_index = None
+		try:
+			if self.online_solver == None:
+				self.startup_solver ()
+			self.write ('\n'.join ([msg for (msg, _) in batch]))
+			for (msg, _) in batch:
+				response = self.online_solver.stdout.readline ().strip ()
+				if response != 'success':
+					raise ConversationProblem (msg, response)
+		except (IOError, ConversationProblem), e:
+			if isinstance (e, ConversationProblem):
+				trace ('SMT batched send failed at %r' % e.prompt)
+				trace ('I got %r' % e.response)
+			trace ('resending %d commands singly' % len (batch))
+			if self.online_solver != None:
+				close_solver_process (self.online_solver)
+			self.online_solver = None
+			for (msg, is_model) in batch:
+				try:
+					self.solver_loop (lambda: self.send_inner (msg,
+						is_model = is_model))
+				except ConversationProblem, e:
+					# don't let an enclosing solver_loop retry
+					# without the rejected command
+					raise SolverFailure ('command rejected: %r'
+						% e.response)
+			return
+		for (msg, is_model) in batch:
+			self.replayable.append ((msg, is_model))
+			self.replay_hash.update (msg + '\n')
+
 	def get_s_expression (self, prompt):
 		return get_s_expression (self.online_solver.stdout, prompt)
 
 	def prompt_s_expression_inner (self, prompt):
+		self.flush_sends ()
 		try:
 			self.write (prompt)
 			return self.get_s_expression (prompt)
@@ -749,7 +1870,7 @@ class Solver:
 		return self.solver_loop (lambda:
 			self.prompt_s_expression_inner (prompt))
 
-	def hyps_sat_raw_inner (self, hyps, model, unsat_core):
+	def hyps_sat_raw_inner (self, hyps, model, unsat_core, cone = None):
 		self.send_inner ('(push 1)', replay = False)
 		for hyp in hyps:
 			self.send_inner ('(assert %s)' % hyp, replay = False,
@@ -762,7 +1883,7 @@ class Solver:
 		m = {}
 		ucs = []
 		if response == 'sat' and model:
-			all_ok = self.fetch_model (m)
+			all_ok = self.fetch_model (m, cone = cone)
 		if response == 'unsat' and unsat_core:
 			ucs = self.get_unsat_core ()
 			all_ok = ucs != None
@@ -771,6 +1892,213 @@ class Solver:
 
 		return (response, m, ucs, all_ok)
 
+	def portfolio_sat_raw_inner (self, hyps, model, cone = None):
+		"""like hyps_sat_raw_inner, but the query is raced on every
+		online solver. the first sat/unsat answer is used. the other
+		solvers are left to finish the query, and are brought back to
+		the level they raced from (see settle_portfolio_loser) when
+		next needed. a solver still busy with an earlier query sits
+		the race out."""
+		import select
+		if self.online_solver == None:
+			self.startup_solver ()
+		self.flush_sends ()
+		query = (['(push 1)'] + ['(assert %s)' % hyp for hyp in hyps]
+			+ ['(check-sat)'])
+		solvers = self.fast_solvers
+		recorded = recorded_race_winner (solvers, 'portfolio')
+		if recorded != None:
+			names = [recorded]
+			if recorded.startswith ('-'):
+				names = [nm for nm in recorded[1:].split (',')
+					if nm]
+			solvers = [solver for solver in solvers
+				if solver.name in names]
+			if len (solvers) != len (names):
+				raise ReplayMiss ('recorded portfolio racers %s'
+					% recorded)
+		procs = [(solver, self.portfolio_racer (solver, False))
+			for solver in solvers]
+		if (self.fast_solver in solvers
+				and not [proc for (_, proc) in procs if proc]):
+			# everything is busy, so wait for the main solver
+			procs = [(self.fast_solver, self.portfolio_racer (
+				self.fast_solver, True))]
+		racers = {}
+		raced = []
+		for (solver, proc) in procs:
+			if proc == None:
+				continue
+			raced.append (solver.name)
+			try:
+				proc.stdin.write ('\n'.join (query) + '\n')
+				proc.stdin.flush ()
+			except IOError, e:
+				self.drop_portfolio_solver (solver, proc)
+				continue
+			racers[proc.stdout.fileno ()] = [solver, proc, len (query) - 1]
+
+		winner = None
+		responses = []
+		while racers and not winner:
+			rlist = [fd for (fd, (_, proc, _)) in racers.iteritems ()
+				if proc.stdout.has_line ()]
+			if not rlist:
+				start = time.time ()
+				(rlist, _, _) = select.select (racers.keys (), [], [])
+				solver_wait_time[0] += time.time () - start
+			for fd in rlist:
+				[solver, proc, acks] = racers[fd]
+				try:
+					response = proc.stdout.readline ().strip ()
+				except IOError, e:
+					response = 'IOError'
+				if acks and response == 'success':
+					racers[fd][2] -= 1
+					continue
+				del racers[fd]
+				responses.append ((solver.name, response))
+				if not acks and response in ['sat', 'unsat']:
+					winner = (solver, proc, response)
+					break
+				if (acks or response != 'unknown'
+						or not self.portfolio_send (proc,
+							['(pop 1)'])):
+					self.drop_portfolio_solver (solver, proc)
+		for (solver, proc, acks) in racers.values ():
+			# the answer and any acknowledgements still to come
+			proc.portfolio_pending = acks + 1
+		if winner:
+			note_race_winner (self.fast_solvers, 'portfolio',
+				winner[0].name)
+		else:
+			note_race_winner (self.fast_solvers, 'portfolio',
+				'-' + ','.join (raced))
+
+		if not winner:
+			trace ('no portfolio result: %s' % responses)
+			if [r for (_, r) in responses if r == 'unknown']:
+				return ('unknown', {}, [], True)
+			raise ConversationProblem ('(check-sat)', responses)
+		(solver, proc, response) = winner
+		trace ('Got %r from %s in portfolio.' % (response, solver.name))
+
+		m = {}
+		all_ok = True
+		request = None
+		if response == 'sat' and model:
+			request = self.fetch_model_request (cone)
+		if request:
+			try:
+				proc.stdin.write (request + '\n')
+				proc.stdin.flush ()
+			except IOError, e:
+				raise ConversationProblem ('fetch-model', 'IOError')
+			all_ok = self.fetch_model_response (m,
+				stream = proc.stdout)
+		if not self.portfolio_send (proc, ['(pop 1)']):
+			self.drop_portfolio_solver (solver, proc)
+		return (response, m, [], all_ok)
+
+	def portfolio_racer (self, solver, wait):
+		"""the process of a portfolio solver, ready for a query, or
+		None if it's busy with an earlier query or has failed."""
+		if solver != self.fast_solver:
+			return self.sync_portfolio_solver (solver, wait)
+		proc = self.online_solver
+		if not self.settle_portfolio_loser (solver, proc, wait):
+			return None
+		return proc
+
+	def settle_portfolio_loser (self, solver, proc, wait):
+		"""bring a solver which lost a portfolio race back to the
+		level it raced from, by reading the rest of its answer and
+		popping the query. the answer is waited for (up to the
+		solver's timeout) if wait is set. returns whether the solver
+		is ready for use. a solver which gives a bad answer or times
+		out is dropped."""
+		import select
+		pending = getattr (proc, 'portfolio_pending', 0)
+		deadline = time.time () + solver.timeout
+		try:
+			while pending:
+				if not proc.stdout.has_line ():
+					timeout = 0
+					if wait:
+						timeout = max (0,
+							deadline - time.time ())
+					start = time.time ()
+					(rlist, _, _) = select.select (
+						[proc.stdout], [], [], timeout)
+					solver_wait_time[0] += time.time () - start
+					if not rlist and not wait:
+						proc.portfolio_pending = pending
+						return False
+					if not rlist:
+						trace ('%s timed out after losing'
+							' a portfolio race' % solver.name)
+						self.drop_portfolio_solver (solver, proc)
+						return False
+				response = proc.stdout.readline ().strip ()
+				pending -= 1
+				if pending and response != 'success':
+					raise IOError ('bad acknowledgement')
+				if not pending and response not in ['sat',
+						'unsat', 'unknown']:
+					raise IOError ('bad answer')
+		except IOError, e:
+			self.drop_portfolio_solver (solver, proc)
+			return False
+		if getattr (proc, 'portfolio_pending', 0):
+			proc.portfolio_pending = 0
+			if not self.portfolio_send (proc, ['(pop 1)']):
+				self.drop_portfolio_solver (solver, proc)
+				return False
+		return True
+
+	def sync_portfolio_solver (self, solver, wait = True):
+		"""start (if need be) one of the extra online solvers of the
+		portfolio, and send it anything from replayable it's missing."""
+		msgs = []
+		if solver not in self.portfolio_solvers:
+			proc = start_solver_process (solver.args,
+				solver.timeout)
+			self.portfolio_solvers[solver] = (proc, 0)
+			msgs = self.init_replay + ['(push 1)']
+		(proc, synced) = self.portfolio_solvers[solver]
+		if not self.settle_portfolio_loser (solver, proc, wait):
+			return None
+		msgs += [msg for (msg, _) in self.replayable[synced:]]
+		if not self.portfolio_send (proc, msgs):
+			trace ('failed to sync %s, dropping it' % solver.name)
+			self.drop_portfolio_solver (solver, proc)
+			return None
+		self.portfolio_solvers[solver] = (proc, len (self.replayable))
+		return proc
+
+	def portfolio_send (self, proc, msgs):
+		if not msgs:
+			return True
+		try:
+			proc.stdin.write ('\n'.join (msgs) + '\n')
+			proc.stdin.flush ()
+			for msg in msgs:
+				if proc.stdout.readline ().strip () != 'success':
+					return False
+		except IOError, e:
+			return False
+		return True
+
+	def drop_portfolio_solver (self, solver, proc):
+		os.killpg (proc.pid, signal.SIGKILL)
+		proc.stdin.close ()
+		proc.stdout.close ()
+		proc.wait ()
+		if proc == self.online_solver:
+			self.online_solver = None
+		elif solver in self.portfolio_solvers:
+			del self.portfolio_solvers[solver]
+
 	def add_var (self, name, typ, kind = 'Var',
 			mem_name = None,
 			ignore_external_names = False):
@@ -824,7 +2152,8 @@ class Solver:
 			trace ('WARNING: redef of var %r to name %s' % (val, name))
 
 		typ = smt_typ (val.typ)
-		self.send ('(define-fun %s () %s %s)' % (name, typ, smt))
+		self.send ('(define-fun %s () %s %s)' % (name, typ,
+			smt))
 
 		self.defs[name] = parse_s_expression (smt)
 		if typ_representable (val.typ):
@@ -846,8 +2175,11 @@ class Solver:
 			assert ro_witness == 'rodata-witness'
 			assert ro_witness_val == 'rodata-witness-val'
 			[rodata_data, rodata_addr, rodata_typ] = rodata
-			eq_vs = [(smt_num (p, 32), smt_num (v, 32))
-				for (p, v) in rodata_data.iteritems ()]
+			if self.lazy_rodata:
+				eq_vs = []
+			else:
+				eq_vs = [(smt_num (p, 32), smt_num (v, 32))
+					for (p, v) in rodata_data.iteritems ()]
 			eq_vs.append (('rodata-witness', 'rodata-witness-val'))
 			eqs = ['(= (load-word32 m %s) %s)' % v for v in eq_vs]
 			ro_def = '(and %s)' % ' \n  '.join (eqs)
@@ -860,11 +2192,139 @@ class Solver:
 			assn = '(and %s)' % ' '.join (assns)
 			self.assert_fact_smt (assn)
 			imp_ro_def = eqs[-1]
-		self.send ('(define-fun rodata ((m %s)) Bool %s)' % (
-			smt_typ (builtinTs['Mem']), ro_def))
+		if self.lazy_rodata:
+			self.send ('(declare-fun rodata (%s) Bool)'
+				% smt_typ (builtinTs['Mem']))
+		else:
+			self.send ('(define-fun rodata ((m %s)) Bool %s)' % (
+				smt_typ (builtinTs['Mem']), ro_def))
 		self.send ('(define-fun implies-rodata ((m %s)) Bool %s)' % (
 			smt_typ (builtinTs['Mem']), imp_ro_def))
 
+	def note_rodata_mem (self, m):
+		if self.lazy_rodata and m not in self.rodata_mems:
+			self.rodata_mems.append (m)
+
+	def note_rodata_read (self, p, bits):
+		"""note a load of a word (or part of one) at p, so that in
+		lazy rodata mode the word's contents are asserted of the
+		memories the query assumes (rodata m) of."""
+		if not self.lazy_rodata:
+			return
+		[rodata_data, _, _] = rodata
+		addr = smt_word32_literal (p)
+		if addr != None:
+			reads = [('Concrete', a)
+				for a in range (addr & ~ 3, addr + (bits / 8), 4)
+				if a in rodata_data]
+		elif bits == 64:
+			reads = [('Symbolic', p),
+				('Symbolic', '(bvadd %s #x00000004)' % p)]
+		else:
+			reads = [('Symbolic', p)]
+		for r in reads:
+			if r not in self.rodata_reads_set:
+				self.rodata_reads_set.add (r)
+				self.rodata_reads.append (r)
+
+	def add_rodata_table (self, (start, end)):
+		"""a memory holding the contents of .rodata, for the values of
+		symbolic reads. it's filled in for a range of addresses at a
+		time, as reads of them are found."""
+		[rodata_data, _, _] = rodata
+		if self.rodata_table == None:
+			self.rodata_table = self.add_var ('rodata-table',
+				builtinTs['Mem'])
+		for a in range (start, end, 4):
+			if a in rodata_data and a not in self.rodata_table_words:
+				self.rodata_table_words.add (a)
+				self.assert_fact_smt ('(= (load-word32 %s %s) %s)'
+					% (self.rodata_table, smt_num (a, 32),
+						smt_num (rodata_data[a], 32)))
+		return self.rodata_table
+
+	def rodata_read_range (self, p):
+		"""the range of addresses the facts about a symbolic read at p
+		cover. a read is taken to stay within the .rodata object whose
+		address appears in p (e.g. a table indexed from its start, or
+		in the definition of a name in p), and
+		nothing is said of reads outside it, which is sound but may be
+		incomplete. a read with no such object falls back to all of
+		.rodata."""
+		[_, rodata_addr, rodata_typ] = rodata
+		start = rodata_addr.val
+		end = start + rodata_typ.size ()
+		if self.rodata_objects == None:
+			self.rodata_objects = sorted ([(addr, addr + size)
+				for (addr, size, section) in symbols.itervalues ()
+				if section == '.rodata' and size > 0])
+		objs = set ()
+		# look through the names defined for parts of p, too
+		todo = [parse_s_expression (p)]
+		seen = set ()
+		while todo:
+			x = todo.pop ()
+			if type (x) == tuple:
+				todo.extend (x)
+			elif x in self.defs and x not in seen:
+				seen.add (x)
+				todo.append (self.defs[x])
+			elif smt_word32_literal (x) != None:
+				a = smt_word32_literal (x)
+				objs.update ([(s, e) for (s, e)
+					in self.rodata_objects if s <= a < e])
+		if len (objs) == 1:
+			[(s, e)] = list (objs)
+			return (max (start, s & ~ 3), min (end, e))
+		self.rodata_fallbacks += 1
+		trace ('ROData read of %s not within one object, using'
+			' all of .rodata (%d times)' % (p, self.rodata_fallbacks))
+		return (start, end)
+
+	def rodata_fact (self, m, (kind, p)):
+		[rodata_data, rodata_addr, rodata_typ] = rodata
+		if kind == 'Witness':
+			return ('(=> (rodata %s) (= (load-word32 %s rodata-witness)'
+				' rodata-witness-val))' % (m, m))
+		elif kind == 'Concrete':
+			return '(=> (rodata %s) (= (load-word32 %s %s) %s))' % (
+				m, m, smt_num (p, 32), smt_num (rodata_data[p], 32))
+		(start, end) = self.rodata_read_range (p)
+		table = self.add_rodata_table ((start, end))
+		# the word read must be in range, and not in a gap, for
+		# which (rodata m) says nothing
+		conds = ['(rodata %s)' % m,
+			'(bvule %s %s)' % (smt_num (start, 32), p),
+			'(bvult %s %s)' % (p, smt_num (end, 32))]
+		conds += ['(not (= (bvand %s #xfffffffc) %s))'
+			% (p, smt_num (a, 32)) for a in range (start & ~ 3, end, 4)
+			if a not in rodata_data]
+		return '(=> (and %s) (= (load-word32 %s %s) (load-word32 %s %s)))' % (
+			' '.join (conds), m, p, table, p)
+
+	def add_rodata_assertions (self):
+		"""in lazy rodata mode, assert of each memory m in (rodata m)
+		the contents of each word read that may be in .rodata. this
+		is weaker than the full definition of rodata, so an unsat
+		result is still sound."""
+		if not self.lazy_rodata:
+			return
+		(n_mems, n_reads) = self.rodata_facts_done
+		if (n_mems, n_reads) == (len (self.rodata_mems),
+				len (self.rodata_reads)):
+			return
+		trace ('ROData facts: %d mems, %d reads' % (len (self.rodata_mems),
+			len (self.rodata_reads)))
+		for (i, m) in enumerate (self.rodata_mems):
+			if i < n_mems:
+				reads = self.rodata_reads[n_reads:]
+			else:
+				reads = self.rodata_reads
+			for r in reads:
+				self.assert_fact_smt (self.rodata_fact (m, r))
+		self.rodata_facts_done = (len (self.rodata_mems),
+			len (self.rodata_reads))
+
 	def check_hyp_raw (self, hyp, model = None, force_solv = False):
 		return self.hyps_sat_raw ([('(not %s)' % hyp, None)],
 			model = model, unsat_core = None,
@@ -879,10 +2339,37 @@ class Solver:
 	def hyps_sat_raw (self, hyps, model = None, unsat_core = None,
 			force_solv = False, recursion = False):
 		assert self.unsat_cores or unsat_core == None
+		self.add_rodata_assertions ()
 
 		hyp_dict = {}
 		raw_hyps = [(hyp2, tag) for (hyp, tag) in hyps
 			for hyp2 in split_hyp (hyp)]
+
+		cone = None
+		with_model = model != None
+		if isinstance (model, LazyModel):
+			cone = self.model_cone (model.exprs)
+			model.solv = self
+			model.hyps = raw_hyps
+			with_model = 'cone %s %s' % (sorted (cone[0]),
+				sorted ([nm for (nm, _) in cone[1].itervalues ()]))
+
+		start = time.time ()
+		cache_key = None
+		if verdict_cache_dir[0] and unsat_core == None:
+			cache_key = self.verdict_cache_key (raw_hyps,
+				with_model)
+			response = verdict_cache_lookup (cache_key, model)
+			if response:
+				trace ('Got %r from verdict cache.' % response)
+				note_solver_event ('hyps_sat_raw', 'cache',
+					'cache', len (raw_hyps), 0, start, response)
+				self.note_verdict (raw_hyps, response,
+					recursion = recursion)
+				if response == 'sat':
+					note_lazy_model_fetched (model)
+				return response
+
 		hyps = [self.next_hyp (h, hyp_dict) for h in raw_hyps]
 		succ = False
 		if force_solv != 'Slow':
@@ -890,11 +2377,28 @@ class Solver:
 			for (hyp, _) in raw_hyps:
 				trace ('  ' + hyp)
 			l = lambda: self.hyps_sat_raw_inner (hyps,
-                                        model != None, unsat_core != None)
+                                        model != None, unsat_core != None,
+					cone = cone)
+			(name, strat) = (self.fast_solver.name, 'online')
+			if (online_portfolio[0] and len (self.fast_solvers) > 1
+					and unsat_core == None):
+				l = lambda: self.portfolio_sat_raw_inner (hyps,
+					model != None, cone = cone)
+				(name, strat) = ('portfolio', 'portfolio')
+			fast_start = time.time ()
+			cpu = solver_cpu_time (self.online_solver)
 			try:
 				(response, m, ucs, succ) = self.solver_loop (l)
 			except ConversationProblem, e:
 				response = 'ConversationProblem'
+			cpu2 = solver_cpu_time (self.online_solver)
+			if cpu != None and cpu2 != None and strat == 'online':
+				cpu = cpu2 - cpu
+			else:
+				cpu = None
+			note_solver_event ('hyps_sat_raw', name, strat,
+				len (hyps), sum ([len (h) for h in hyps]),
+				fast_start, response, cpu = cpu)
 
 		if ((not succ or response not in ['sat', 'unsat'])
 				and self.slow_solver and force_solv != 'Fast'):
@@ -904,7 +2408,7 @@ class Solver:
 			trace ('running %s' % self.slow_solver.name)
 			self.close ()
 			response = self.use_slow_solver (raw_hyps, model = model,
-				unsat_core = unsat_core)
+				unsat_core = unsat_core, cone = cone)
 		elif m:
 			model.clear ()
 			model.update (m)
@@ -912,12 +2416,90 @@ class Solver:
 			unsat_core.extend (self.get_unsat_core_tags (ucs,
 				hyp_dict))
 
+		if response == 'sat' and model:
+			self.check_model ([h for (h, _) in raw_hyps],
+				model, recursion = recursion)
+		elif response not in ['sat', 'unsat']:
+			# couldn't get a useful response from either solver.
+			trace ('All solvers failed to resolve sat/unsat!')
+			trace ('last solver result %r' % response)
+			raise SolverFailure (response)
+
+		if cache_key:
+			verdict_cache_store (cache_key, response, model)
+		self.note_verdict (raw_hyps, response, recursion = recursion)
+		if response == 'sat':
+			note_lazy_model_fetched (model)
+		return response
+
+	def model_cone (self, exprs):
+		"""the model variables and expressions needed to evaluate
+		exprs, following definitions back to what they depend on."""
+		stack = []
+		for expr in exprs:
+			if type (expr) != str:
+				expr = smt_expr (expr, {}, self)
+			stack.append (parse_s_expression (expr))
+		vs = set ()
+		model_exprs = {}
+		seen = set ()
+		while stack:
+			s = stack.pop ()
+			if s in seen:
+				continue
+			seen.add (s)
+			if type (s) == tuple:
+				if s in self.model_exprs:
+					model_exprs[s] = self.model_exprs[s]
+				else:
+					stack.extend (s)
+			elif s in self.model_vars:
+				vs.add (s)
+			elif s in self.defs:
+				stack.append (self.defs[s])
+		return (vs, model_exprs)
+
+	def in_model (self, x):
+		if type (x) == str:
+			return x in self.model_vars
+		return type (x) == tuple and x in self.model_exprs
+
+	def fetch_rest_of_model (self, model, x):
+		"""complete a LazyModel, by repeating its query with the
+		values fetched so far held fixed."""
+		trace ('%s is outside the model cone, fetching the rest.'
+			% flat_s_expression (x))
+		fixed = [('(= %s %s)' % (flat_s_expression (x),
+				smt_expr (model[x], {}, self)), None)
+			for x in model.fetched]
+		m = {}
+		res = self.hyps_sat_raw (model.hyps + fixed, model = m,
+			recursion = True)
+		if res != 'sat':
+			trace ('WARNING: got %r fetching rest of model.' % res)
+			return False
+		for (x, v) in m.iteritems ():
+			if not dict.__contains__ (model, x):
+				dict.__setitem__ (model, x, v)
+		return True
+
+	def verdict_cache_key (self, raw_hyps, with_model):
+		h = self.replay_hash.copy ()
+		h.update ('-- query (model: %s)\n' % with_model)
+		for (hyp, _) in raw_hyps:
+			h.update (hyp + '\n')
+		return h.hexdigest ()
+
+	def goal_cache_key (self, goal):
+		if not verdict_cache_dir[0]:
+			return None
+		raw_hyps = [(hyp, None) for hyp in split_hyp (goal)]
+		return self.verdict_cache_key (raw_hyps, False)
+
+	def note_verdict (self, raw_hyps, response, recursion = False):
 		if response == 'sat':
 			if not recursion:
 				last_satisfiable_hyps[0] = list (raw_hyps)
-			if model:
-				self.check_model ([h for (h, _) in raw_hyps],
-					model, recursion = recursion)
 		elif response == 'unsat':
 			fact = '(not (and %s))' % ' '.join ([h
 				for (h, _) in raw_hyps])
@@ -925,12 +2507,6 @@ class Solver:
 			# lead to inaccurate cores in the future
 			if not self.unsat_cores:
 				self.send ('(assert %s)' % fact)
-		else:
-			# couldn't get a useful response from either solver.
-			trace ('All solvers failed to resolve sat/unsat!')
-			trace ('last solver result %r' % response)
-			raise SolverFailure (response)
-		return response
 
 	def get_unsat_core_tags (self, fact_names, hyps):
 		names = set (fact_names)
@@ -944,62 +2520,143 @@ class Solver:
 		trace ('uc tags: %s' % core)
 		return core
 
-	def write_solv_script (self, f, input_msgs):
-		for msg in self.init_replay:
-			if (':print-success' not in msg
-					and ':produce-unsat-cores' not in msg):
-				f.write (msg + '\n')
-		for (msg, _) in self.replayable:
-			f.write (msg + '\n')
-
+	def solv_script_init (self):
+		return ''.join ([msg + '\n' for msg in self.init_replay
+			if ':print-success' not in msg
+			if ':produce-unsat-cores' not in msg])
+
+	def solv_script_prefix (self, prefix_len = None):
+		"""the part of an offline solver's input which is common to
+		all queries (those made so far, or the first prefix_len), as
+		a list of parts for script_chunks. the commands are streamed
+		from the replay log rather than copied into a string."""
+		return [self.solv_script_init (),
+			self.replayable.span (0, prefix_len)]
+
+	def update_slice_index (self):
+		"""index the symbols declared and used by each replayable
+		command, extending the index as replayable grows."""
+		if self.slice_index == None:
+			self.slice_index = (0, {}, {}, [])
+		(n, decls, uses, cmds) = self.slice_index
+		for (msg, _) in self.replayable.iter_range (n):
+			i = len (cmds)
+			syms = set (smt_symbol_re.findall (msg))
+			bits = msg.split (None, 2)
+			if bits[0] in ['(declare-fun', '(define-fun']:
+				cmds.append (('decl', syms))
+				decls[bits[1]] = i
+			elif bits[0] == '(assert':
+				cmds.append (('assert', syms))
+				for sym in syms:
+					uses.setdefault (sym, []).append (i)
+			else:
+				cmds.append (('other', syms))
+		self.slice_index = (len (cmds), decls, uses, cmds)
+		return self.slice_index
+
+	def sliced_script_prefix (self, goals):
+		"""an offline solver prefix restricted to the declarations and
+		assertions the goals depend on: the symbols of the goals, the
+		definitions of those symbols, and every assertion mentioning a
+		relevant symbol, closed transitively. dropping assertions can
+		only turn unsat into sat, so a sat answer must be confirmed
+		with the full prefix."""
+		(_, decls, uses, cmds) = self.update_slice_index ()
+		keep = set ([i for (i, (kind, _)) in enumerate (cmds)
+			if kind == 'other'])
+		relevant = set ()
+		stack = [sym for goal in goals
+			for sym in smt_symbol_re.findall (goal)]
+		while stack:
+			sym = stack.pop ()
+			if sym in relevant or sym not in decls:
+				continue
+			relevant.add (sym)
+			i = decls[sym]
+			keep.add (i)
+			stack.extend (cmds[i][1])
+			for j in uses.get (sym, []):
+				if j not in keep:
+					keep.add (j)
+					stack.extend (cmds[j][1])
+		trace ('sliced offline query: %d of %d commands'
+			% (len (keep), len (cmds)))
+		return [self.solv_script_init () + ''.join ([msg + '\n'
+			for (i, (msg, _)) in enumerate (self.replayable)
+			if i in keep])]
+
+	def write_solv_script (self, f, input_msgs, prefix_len = None):
+		for chunk in script_chunks (self.solv_script_prefix (prefix_len)):
+			f.write (chunk)
 		for msg in input_msgs:
 			f.write (msg + '\n')
 
 		f.flush ()
 
 	def exec_slow_solver (self, input_msgs, timeout = None,
-			use_this_solver = None):
+			use_this_solver = None, prefix = None):
 		solver = self.slow_solver
 		if use_this_solver:
 			solver = use_this_solver
 		if not solver:
 			return 'no-slow-solver'
 
-		(fd, name) = tempfile.mkstemp (suffix='.txt', prefix='temp-input')
-		tmpfile_write = open (name, 'w')
-		self.write_solv_script (tmpfile_write, input_msgs)
-		tmpfile_write.close ()
-		
-		proc = subprocess.Popen (solver.args,
-			stdin = fd, stdout = subprocess.PIPE,
-			preexec_fn = preexec (timeout))
-		os.close (fd)
+		if prefix == None:
+			prefix = self.solv_script_prefix ()
+		parts = prefix + [''.join ([msg + '\n' for msg in input_msgs])]
+		size = script_len (parts)
+		qclass = query_class (solver, size)
+		timeout = adaptive_timeout (qclass, timeout)
+		# close_fds (in start_solver_process), so that other solvers
+		# don't hold this one's stdin open and keep it from seeing the
+		# end of its input
+		proc = start_solver_process (solver.args, timeout)
+		proc.query_class = qclass
+		proc.query_start = time.time ()
+		proc.script_bytes = size
+		writer = threading.Thread (target = write_solver_input,
+			args = (proc.stdin, script_chunks (parts)))
+		writer.daemon = True
+		writer.start ()
 
 		return (proc, proc.stdout)
 
 	def use_slow_solver (self, hyps, model = None, unsat_core = None,
-			use_safe_solver = None):
+			use_safe_solver = None, cone = None):
 		start = time.time ()
 
 		cmds = ['(assert %s)' % hyp for (hyp, _) in hyps
 			] + ['(check-sat)']
+		solver = self.slow_solver
 
-		if model != None:
-			cmds.append (self.fetch_model_request ())
+		if slice_offline_queries[0] and unsat_core == None:
+			response = self.use_sliced_slow_solver (solver,
+				[hyp for (hyp, _) in hyps], cmds)
+			if response == 'unsat':
+				return response
+			trace ('sliced query gave %r, trying in full' % response)
+			start = time.time ()
 
-		solver = self.slow_solver
+		request = None
+		if model != None:
+			request = self.fetch_model_request (cone)
+		if request:
+			cmds.append (request)
 
-		(_, output) = self.exec_slow_solver (cmds,
+		(proc, output) = self.exec_slow_solver (cmds,
 			timeout = solver.timeout, use_this_solver = solver)
 
 		response = output.readline ().strip ()
-		if model != None and response == 'sat':
+		if request and response == 'sat':
 			assert self.fetch_model_response (model,
 				stream = output)
 		if unsat_core != None and response == 'unsat':
 			trace ('WARNING no unsat core from %s' % solver.name)
 			unsat_core.extend ([tag for (_, tag) in hyps])
 
+		cpu = solver_cpu_time (proc)
+		note_query_time (proc)
 		output.close ()
 
 		if response not in ['sat', 'unsat']:
@@ -1008,19 +2665,39 @@ class Solver:
 		end = time.time ()
 		trace ('Got %r from %s after %ds.' % (response,
 			solver.name, int (end - start)))
+		note_solver_event ('use_slow_solver', solver.name, 'offline',
+			len (hyps), proc.script_bytes, start, response,
+			cpu = cpu)
 		# adjust to save difficult problems
-		cutoff_time = save_solv_example_time[0]
-		if cutoff_time != -1 and end - start > cutoff_time:
-			save_solv_example (self, cmds,
-				comments = ['reference time %s seconds' % (end - start)])
+		maybe_save_solv_example (self, cmds, solver, 'offline',
+			len (hyps), start, response)
 
 		if model:
 			self.check_model ([h for (h, _) in hyps], model)
 
 		return response
 
-	def add_parallel_solver (self, k, hyps, use_this_solver = None):
-		cmds = ['(assert %s)' % hyp for hyp in hyps] + ['(check-sat)']
+	def use_sliced_slow_solver (self, solver, hyps, cmds):
+		start = time.time ()
+		prefix = self.sliced_script_prefix (hyps)
+		(proc, output) = self.exec_slow_solver (cmds,
+			timeout = solver.timeout, use_this_solver = solver,
+			prefix = prefix)
+		response = output.readline ().strip ()
+		cpu = solver_cpu_time (proc)
+		note_query_time (proc)
+		output.close ()
+		trace ('Got %r from %s (sliced) after %ds.' % (response,
+			solver.name, int (time.time () - start)))
+		note_solver_event ('use_slow_solver', solver.name, 'sliced',
+			len (hyps), proc.script_bytes, start, response,
+			cpu = cpu)
+		return response
+
+	def add_parallel_solver (self, k, hyps, use_this_solver = None,
+			strategy = None, sliced = False):
+		cmds = ['(assert %s)' % hyp for hyp in hyps
+			] + ['(check-sat)']
 
 		for hyp in hyps:
 			trace ('  %s' % hyp)
@@ -1031,24 +2708,69 @@ class Solver:
 		solver = self.slow_solver
 		if use_this_solver:
 			solver = use_this_solver
+		start = time.time ()
+		prefix = None
+		if sliced:
+			prefix = self.sliced_script_prefix (hyps)
+			strategy = '%s sliced' % strategy
 		(proc, output) = self.exec_slow_solver (cmds,
-			timeout = solver.timeout, use_this_solver = solver)
+			timeout = solver.timeout, use_this_solver = solver,
+			prefix = prefix)
 		self.parallel_solvers[k] = (hyps, proc, output, solver)
+		self.parallel_solver_starts[k] = (start, strategy,
+			proc.script_bytes)
+		if sliced:
+			# a sliced query isn't the query saved to the corpus
+			self.parallel_solver_cmds[k] = None
+		else:
+			# replayable may grow before the query is saved
+			self.parallel_solver_cmds[k] = (cmds,
+				len (self.replayable))
 
 	def wait_parallel_solver (self):
 		import select
 		assert self.parallel_solvers
-		fds = dict ([(output.fileno (), k) for (k, (_, _, output, _))
-			in self.parallel_solvers.iteritems ()])
-		(rlist, _, _) = select.select (fds.keys (), [], [])
-		k = fds[rlist.pop ()]
+		impls = [solver for (_, _, _, solver)
+			in self.parallel_solvers.itervalues ()]
+		recorded = recorded_race_winner (impls, 'parallel')
+		if recorded != None:
+			ks = [k for k in self.parallel_solvers
+				if repr (k) == recorded]
+			if not ks:
+				raise ReplayMiss ('recorded parallel winner %s'
+					% recorded)
+			k = ks[0]
+		else:
+			fds = dict ([(output.fileno (), k) for (k, (_, _,
+				output, _)) in self.parallel_solvers.iteritems ()])
+			rlist = [output.fileno () for (_, _, output, _)
+				in self.parallel_solvers.itervalues ()
+				if output.has_line ()]
+			if not rlist:
+				start = time.time ()
+				(rlist, _, _) = select.select (fds.keys (),
+					[], [])
+				solver_wait_time[0] += time.time () - start
+			k = fds[rlist.pop ()]
+			note_race_winner (impls, 'parallel', repr (k))
 		(hyps, proc, output, solver) = self.parallel_solvers[k]
 		del self.parallel_solvers[k]
 		response = output.readline ().strip ()
+		cpu = solver_cpu_time (proc)
+		note_query_time (proc)
 		output.close ()
 		if response not in ['sat', 'unsat']:
 			trace ('SMT conversation problem in parallel solver')
 		trace ('Got %r from %s in parallel.' % (response, solver.name))
+		(start, strat, size) = self.parallel_solver_starts.pop (k)
+		note_solver_event ('wait_parallel_solver', solver.name, strat,
+			len (hyps), size, start, response, cpu = cpu)
+		cmds = self.parallel_solver_cmds.pop (k)
+		if cmds != None:
+			(cmds, prefix_len) = cmds
+			maybe_save_solv_example (self, cmds, solver, strat,
+				len (hyps), start, response,
+				prefix_len = prefix_len)
 		return (k, hyps, response)
 
 	def close_parallel_solvers (self, ks = None):
@@ -1060,6 +2782,8 @@ class Solver:
 			in [self.parallel_solvers[k] for k in ks]]
 		for k in ks:
 			del self.parallel_solvers[k]
+			self.parallel_solver_starts.pop (k, None)
+			self.parallel_solver_cmds.pop (k, None)
 		procs = [proc for (proc, _) in solvs]
 		outputs = [output for (_, output) in solvs]
 		for proc in procs:
@@ -1074,42 +2798,110 @@ class Solver:
 		"""test a series of keyed hypotheses [(k1, h1), (k2, h2) ..etc]
 		either returns (True, -) all hypotheses true
 		or (False, ki) i-th hypothesis unprovable"""
+		start = time.time ()
+		num_hyps = len (hyps)
 		hyps = [(k, hyp) for (k, hyp) in hyps
 			if not self.test_hyp (hyp, env, force_solv = 'Fast',
 				catch = True)]
 		assert not self.parallel_solvers
+		goal_keys = {}
+		if verdict_cache_dir[0]:
+			uncached = []
+			for (k, hyp) in hyps:
+				goal = smt_expr (syntax.mk_not (hyp), env, self)
+				key = self.goal_cache_key (goal)
+				res = verdict_cache_lookup (key, None)
+				if res == 'unsat':
+					continue
+				elif res == 'sat' and not uncached:
+					trace ('  -- hyp refuted by verdict cache')
+					note_solver_event ('parallel_test_hyps',
+						'cache', 'cache', num_hyps, 0,
+						start, 'sat')
+					return (False, k)
+				goal_keys[k] = key
+				uncached.append ((k, hyp))
+			hyps = uncached
 		if not hyps:
+			note_solver_event ('parallel_test_hyps', None, 'online',
+				num_hyps, 0, start, 'unsat')
 			return (True, None)
 		all_hyps = foldr1 (syntax.mk_and, [h for (k, h) in hyps])
-		def spawn ((k, hyp), stratkey):
-			goal = smt_expr (syntax.mk_not (hyp), env, self)
-			[self.add_parallel_solver ((solver.name, strat, k),
-					[goal], use_this_solver = solver)
-				for (solver, strat) in self.strategy
-				if strat == stratkey]
+		# jobs are started in this order, as slots become free. the
+		# first answer for each hyp decides it (as if the hyps were
+		# tested one at a time) and the first hyp, in order, that
+		# isn't confirmed is the one reported.
+		# with slicing, a job is first run on a sliced query, and a
+		# 'hyp' job which isn't confirmed that way is run again in full.
+		sliced = slice_offline_queries[0]
+		jobs = []
 		if len (hyps) > 1:
-			spawn ((None, all_hyps), 'all')
-		spawn (hyps[0], 'hyp')
-		solved = 0
+			jobs.extend ([(solver, strat, None, all_hyps, sliced)
+				for (solver, strat) in self.strategy
+				if strat == 'all'])
+		jobs.extend ([(solver, strat, k, hyp, sliced)
+			for (k, hyp) in hyps
+			for (solver, strat) in self.strategy if strat == 'hyp'])
+		sliced_jobs = {}
+		# never fewer than the 'all' jobs plus one hyp's jobs
+		min_slots = len ([1 for (_, strat) in self.strategy
+			if strat == 'hyp' or len (hyps) > 1])
+		slots = max (num_parallel_solvers (), min_slots)
+		decided = {}
+		res = None
+		k = None
 		while True:
+			while jobs and len (self.parallel_solvers) < slots:
+				job = jobs.pop (0)
+				(solver, strat, k, hyp, sliced) = job
+				if k in decided:
+					continue
+				goal = smt_expr (syntax.mk_not (hyp), env, self)
+				self.add_parallel_solver ((solver.name, strat, k),
+					[goal], use_this_solver = solver,
+					strategy = strat, sliced = sliced)
+				if sliced:
+					sliced_jobs[(solver.name, strat, k)] = job
 			((nm, strat, k), _, res) = self.wait_parallel_solver ()
-			if strat == 'all' and res == 'unsat':
-				trace ('  -- hyps all confirmed by %s' % nm)
+			if strat == 'hyp' and k in decided:
+				continue
+			job = sliced_jobs.pop ((nm, strat, k), None)
+			if job and res != 'unsat':
+				if strat == 'hyp':
+					jobs.insert (0, job[:4] + (False, ))
+				continue
+			if goal_keys and res in ['sat', 'unsat']:
+				if strat == 'hyp':
+					keys = [goal_keys[k]]
+				elif res == 'unsat':
+					keys = goal_keys.values ()
+				else:
+					keys = []
+				for key in keys:
+					verdict_cache_store (key, res, None)
+			if strat == 'all':
+				if res == 'unsat':
+					trace ('  -- hyps all confirmed by %s' % nm)
+					break
+				continue
+			decided[k] = (res, nm)
+			ks = [(solver.name, strat, k)
+				for (solver, strat) in self.strategy]
+			self.close_parallel_solvers (ks)
+			first = [k2 for (k2, _) in hyps
+				if decided.get (k2, ('sat', None))[0] != 'unsat']
+			if not first:
+				trace ('  - hyps confirmed individually')
+				(k, res) = (hyps[-1][0], 'unsat')
 				break
-			elif strat == 'hyp' and res != 'unsat':
+			if first[0] in decided:
+				k = first[0]
+				(res, nm) = decided[k]
 				trace ('  -- hyp refuted by %s' % nm)
 				break
-			if strat == 'hyp':
-				ks = [(solver.name, strat, k)
-					for (solver, strat) in self.strategy]
-				self.close_parallel_solvers (ks)
-				solved += 1
-				if solved < len (hyps):
-					spawn (hyps[solved], 'hyp')
-				else:
-					trace ('  - hyps confirmed individually')
-					break
 		self.close_parallel_solvers ()
+		note_solver_event ('parallel_test_hyps', None, 'parallel',
+			num_hyps, 0, start, res)
 		return (res == 'unsat', k)
 
 	def slow_solver_multisat (self, hyps, model = None, timeout = 300):
@@ -1120,7 +2912,7 @@ class Solver:
 			cmds.extend (['(assert %s)' % hyp, '(check-sat)'])
 			if model != None:
 				cmds.append (self.fetch_model_request ())
-		(_, output) = self.exec_slow_solver (cmds, timeout = timeout)
+		(proc, output) = self.exec_slow_solver (cmds, timeout = timeout)
 
 		assert hyps
 		for (i, hyp) in enumerate (hyps):
@@ -1143,6 +2935,9 @@ class Solver:
 					response = 'sat'
 				break
 
+		note_query_time (proc)
+		output.close ()
+
 		if model:
 			self.check_model (most_sat, model)
 
@@ -1150,14 +2945,18 @@ class Solver:
 
 		return response
 
-	def fetch_model_request (self):
+	def fetch_model_request (self, cone = None):
 		vs = self.model_vars
 		exprs = self.model_exprs
+		if cone != None:
+			(vs, exprs) = cone
 
 		trace ('will fetch model%s for %d vars and %d compound exprs.'
 			% (self.name_ext, len (vs), len (exprs)))
 
 		vs2 = tuple (vs) + tuple ([nm for (nm, typ) in exprs.values ()])
+		if not vs2:
+			return None
 		return '(get-value (%s))' % ' '.join (vs2)
 
 	def fetch_model_response (self, model, stream = None):
@@ -1168,13 +2967,18 @@ class Solver:
 		if values == None:
 			trace ('Failed to fetch model!')
 			return None
+		if model_response_log[0]:
+			f = open (model_response_log[0], 'a')
+			f.write (flat_s_expression (values) + '\n')
+			f.close ()
 
 		if 'as-array' in flat_s_expression (values):
 			trace ('Got unusable array-equality model.')
 			return None
 
+		fetched = set ([nm for (nm, _) in values])
 		abbrvs = [(sexp, name) for (sexp, (name, typ))
-			in self.model_exprs.iteritems ()]
+			in self.model_exprs.iteritems () if name in fetched]
 
 		return make_model (values, model, abbrvs)
 
@@ -1250,9 +3054,13 @@ class Solver:
 		model.update (m)
 		trace ('fixed model!')
 
-	def fetch_model (self, model):
+	def fetch_model (self, model, cone = None):
+		self.flush_sends ()
+		request = self.fetch_model_request (cone)
+		if not request:
+			return True
 		try:
-			self.write (self.fetch_model_request ())
+			self.write (request)
 		except IOError, e:
 			raise ConversationProblem ('fetch-model', 'IOError')
 		return self.fetch_model_response (model)
@@ -1286,8 +3094,8 @@ class Solver:
 		if unsat_tag and self.unsat_cores:
 			name = 'assert%d' % len (self.assertions)
 			self.assertions.append ((unsat_tag, fact))
-			self.send ('(assert (! %s :named %s))' % (fact, name),
-				is_model = False)
+			self.send ('(assert (! %s :named %s))'
+				% (fact, name), is_model = False)
 		else:
 			self.send ('(assert %s)' % fact)
 
@@ -1333,6 +3141,17 @@ class Solver:
 		self.cached_exprs[(name2, 'IsCachedExpr')] = True
 		return name2
 
+	def share_expr (self, s, typ):
+		"""name a term, so that it's sent only once. like any def,
+		the name is a model variable, so models can evaluate terms
+		that refer to it."""
+		if s in self.cached_exprs:
+			return self.cached_exprs[s]
+		name = self.add_def ('shared', mk_smt_expr (s, typ), {})
+		self.cached_exprs[s] = name
+		self.cached_exprs[(name, 'IsCachedExpr')] = True
+		return name
+
 	def note_ptr (self, p_s):
 		if p_s in self.ptrs:
 			p = self.ptrs[p_s]
@@ -1370,8 +3189,14 @@ class Solver:
 		else:
 			var = self.add_var ('pvalid', boolT)
 			pvalids.setdefault (htd_s, {})
-			others = pvalids[htd_s].items()
+			index = self.pvalid_index.setdefault (htd_s,
+				PValidIndex ())
+			rng = pvalid_range (typ, p_s)
+			others = [(k, pvalids[htd_s][k])
+				for k in index.candidates (rng)]
+			skipped = len (index) - len (others)
 			pvalids[htd_s][(typ, p, kind)] = var
+			index.add ((typ, p, kind), rng)
 
 			def smtify (((typ, p, kind), var)):
 				return (typ, kind, mk_smt_expr (p, word32T),
@@ -1385,16 +3210,20 @@ class Solver:
 				if ('PWeakValid' in kinds and
 						'PGlobalValid' not in kinds):
 					continue
+				(typ2, _, _) = val[0]
 				ass = pvalid_assertion1 (pdata, smtify (val))
 				ass_s = smt_expr (ass, None, None)
 				self.assert_fact_smt (ass_s, unsat_tag =
 					('PValid', 1, var, val[1]))
+				if not pvalid_types_nest (typ, typ2):
+					continue
 				ass = pvalid_assertion2 (pdata, smtify (val))
 				ass_s = smt_expr (ass, None, None)
 				self.assert_fact_smt (ass_s,
 					('PValid', 2, var, val[1]))
 
-			trace ('Now %d related pvalids' % len(pvalids[htd_s]))
+			trace ('Now %d related pvalids (%d known disjoint)'
+				% (len(pvalids[htd_s]), skipped))
 			return var
 
 	def get_imm_basis_mems (self, m, accum):
@@ -1488,7 +3317,7 @@ class Solver:
 	def add_pvalid_dom_assertions (self):
 		if not self.doms:
 			return
-		if cheat_mem_doms:
+		if cheat_mem_doms[0]:
 			return
 		dom = iter (self.doms).next ()[1]
 
@@ -1504,16 +3333,24 @@ class Solver:
 
 		trace ('PValid/Dom complexity: %d, %d' % (len (pvalid_doms[0]),
 			len (pvalid_doms[1])))
+		# each fact is asserted once. an object larger than the
+		# number of domain queries is covered by one range fact
+		# per query rather than by one conjunct per byte.
+		facts = self.pvalid_dom_facts
 		for (var, (p, sz)) in pvs:
-			if sz > len (self.doms) * 4:
+			if sz > len (self.doms):
 				for (q, _, md) in self.doms:
+					if (var, p, sz, md) in facts:
+						continue
+					facts.add ((var, p, sz, md))
 					left = '(bvule %s %s)' % (p, q)
 					right = ('(bvule %s (bvadd %s %s))'
 						% (q, p, smt_num (sz - 1, 32)))
-					lhs = '(and %s %s)' % (left, right)
+					lhs = '(and %s %s %s)' % (var, left, right)
 					self.assert_fact_smt ('(=> %s %s)'
 						% (lhs, md))
-			else:
+			elif (var, p, sz, dom) not in facts:
+				facts.add ((var, p, sz, dom))
 				vs = ['(mem-dom (bvadd %s %s) %s)'
 						% (p, smt_num (i, 32), dom)
 					for i in range (sz)]
@@ -1522,35 +3359,96 @@ class Solver:
 
 		self.pvalid_doms = pvalid_doms
 
-	def narrow_unsat_core (self, solver, asserts):
-		model = ([s for s in self.init_replay
-			if not ':print-success' in s]
-			+ [s for ss in self.replayable
-			for (s, is_model) in ss if is_model])
-		process = subprocess.Popen (solver[1],
-			stdin = subprocess.PIPE, stdout = subprocess.PIPE,
-			preexec_fn = preexec (solver[2]))
-		for s in model:
-			process.stdin.write (s + '\n')
-		asserts = list (asserts)
-		for (i, (ass, tag)) in enumerate (asserts):
-			process.stdin.write ('(assert (! %s :named uc%d))\n'
-				% (ass, i))
-		process.stdin.write ('(check-sat)\n(get-unsat-core)\n')
-		process.stdin.close ()
+	def unsat_core_script (self):
+		"""the commands given to each solver narrowing an unsat core,
+		apart from the named assertions."""
+		return ''.join ([msg + '\n' for msg in self.init_replay
+			if ':print-success' not in msg]
+			+ [msg + '\n' for (msg, is_model) in self.replayable
+			if is_model])
+
+	def start_unsat_core_solver (self, prefix, solver, asserts):
+		cmds = ['(assert (! %s :named uc%d))\n' % (ass, i)
+			for (i, (ass, tag)) in enumerate (asserts)]
+		cmds.append ('(check-sat)\n(get-unsat-core)\n')
+		proc = start_solver_process (solver.args, solver.timeout)
+		writer = threading.Thread (target = write_solver_input,
+			args = (proc.stdin, [prefix, ''.join (cmds)]))
+		writer.daemon = True
+		writer.start ()
+		return proc
+
+	def finish_unsat_core_solver (self, proc, solver, asserts):
 		try:
-			res = get_s_expression (process.stdout, '(check-sat)')
-			core = get_s_expression (process.stdout,
-				'(get-unsat-core)')
+			res = get_s_expression (proc.stdout, '(check-sat)')
+			core = None
+			if res == 'unsat':
+				core = get_s_expression (proc.stdout,
+					'(get-unsat-core)')
 		except ConversationProblem, e:
-			return asserts
-		trace ('got response %r from %s' % (res, solver[0]))
+			res = None
+		proc.stdout.close ()
+		try:
+			os.killpg (proc.pid, signal.SIGKILL)
+		except OSError, e:
+			pass
+		proc.wait ()
+		trace ('got response %r from %s' % (res, solver.name))
 		if res != 'unsat':
-			return asserts
+			return None
 		for s in core:
 			assert s.startswith ('uc')
 		return set ([asserts[int (s[2:])] for s in core])
 
+	def narrow_unsat_cores (self, jobs):
+		"""run each (solver, asserts) job, several at once, giving
+		for each the unsat core found (a subset of the asserts), or
+		None if the solver didn't find the asserts unsat."""
+		prefix = self.unsat_core_script ()
+		results = [None] * len (jobs)
+		running = []
+		def finish ():
+			(i, solver, asserts, proc) = running.pop (0)
+			results[i] = self.finish_unsat_core_solver (proc,
+				solver, asserts)
+		for (i, (solver, asserts)) in enumerate (jobs):
+			if len (running) >= num_parallel_solvers ():
+				finish ()
+			asserts = list (asserts)
+			proc = self.start_unsat_core_solver (prefix, solver,
+				asserts)
+			running.append ((i, solver, asserts, proc))
+		while running:
+			finish ()
+		return results
+
+	def minimise_unsat_core (self, asserts):
+		"""shrink an unsat core by deleting batches of its members,
+		testing the batches in parallel and halving their size when
+		none can be deleted."""
+		core = sorted (asserts)
+		solver = unsat_solver_loop[0]
+		n = num_parallel_solvers ()
+		size = max (1, (len (core) + n - 1) / n)
+		for i in range (unsat_core_minimise_rounds[0]):
+			if len (core) <= 1:
+				break
+			size = min (size, len (core) - 1)
+			batches = [set (core[j : j + size])
+				for j in range (0, len (core), size)]
+			jobs = [(solver, [ass for ass in core
+				if ass not in batch]) for batch in batches]
+			cores = [c for c in self.narrow_unsat_cores (jobs)
+				if c != None]
+			if cores:
+				core = sorted (min (cores, key = len))
+				trace (' .. deleted to %d asserts.' % len (core))
+			elif size == 1:
+				break
+			else:
+				size = max (1, size / 2)
+		return set (core)
+
 	def unsat_core_loop (self, asserts):
 		asserts = set (asserts)
 
@@ -1559,10 +3457,15 @@ class Solver:
 			orig_num_asserts = len (asserts)
 			trace ('Entering unsat_core_loop, %d asserts.'
 				% orig_num_asserts)
-			for solver in unsat_solver_loop:
-				asserts = self.narrow_unsat_core (solver,
-					asserts)
-				trace (' .. now %d asserts.' % len (asserts))
+			# race the solvers, keeping the smallest core
+			cores = self.narrow_unsat_cores ([(solver, asserts)
+				for solver in unsat_solver_loop])
+			cores = [core for core in cores if core != None]
+			if cores:
+				asserts = min (cores, key = len)
+			trace (' .. now %d asserts.' % len (asserts))
+		if unsat_core_minimise_rounds[0]:
+			asserts = self.minimise_unsat_core (asserts)
 		return set ([tag for (_, tag) in asserts])
 
 	def unsat_core_with_loop (self, hyps, env):
@@ -1643,27 +3546,134 @@ def hash_test_hyp_fast (solv, hyp, env, cache):
 	s = smt_expr (hyp, env, solv)
 	return cache.get (s)
 
-paren_re = re.compile (r"(\(|\))")
+s_expression_re = re.compile (r"[()]|[^\s()]+")
+
+def parse_s_expression_bits (bits):
+	"""build the nested tuples for a list of tokens. this is done
+	with an explicit stack, since long chains of memory updates
+	nest deeper than the python recursion limit."""
+	stack = []
+	xs = []
+	for bit in bits:
+		if bit == '(':
+			stack.append (xs)
+			xs = []
+		elif bit == ')':
+			assert stack, bits
+			x = tuple (xs)
+			xs = stack.pop ()
+			xs.append (x)
+		else:
+			xs.append (bit)
+	assert not stack and len (xs) == 1, bits
+	return xs[0]
 
 def parse_s_expressions (ss):
-	bits = [bit for s in ss for split1 in paren_re.split (s)
-		for bit in split1.split ()]
-	def group (n):
-		if bits[n] != '(':
-			return (n + 1, bits[n])
-		xs = []
-		n = n + 1
-		while bits[n] != ')':
-			(n, x) = group (n)
-			xs.append (x)
-		return (n + 1, tuple (xs))
-	(n, v) = group (0)
-	assert n == len (bits), ss
-	return v
+	return parse_s_expression_bits ([bit for s in ss
+		for bit in s_expression_re.findall (s)])
 
 def parse_s_expression (s):
 	return parse_s_expressions ([s])
 
+def pvalid_range (typ, p_s):
+	"""the address of a pointer of fixed-size type as (base, offset,
+	size), with base None for a constant address, or None if the size
+	is not fixed. pointers with the same base are a known distance
+	apart, so whether they overlap can be decided without the solver."""
+	if typ[0] != 'Type':
+		return None
+	size = typ[1].size ()
+	if not size:
+		return None
+	sexp = parse_s_expression (p_s)
+	if smt_word32_literal (sexp) != None:
+		return (None, smt_word32_literal (sexp), size)
+	if sexp[0] == 'bvadd' and len (sexp) == 3:
+		for (x, y) in [sexp[1:], reversed (sexp[1:])]:
+			offs = smt_word32_literal (y)
+			if offs != None:
+				return (flat_s_expression (x), offs, size)
+	return (p_s, 0, size)
+
+def smt_word32_literal (sexp):
+	if type (sexp) != str:
+		return None
+	if sexp.startswith ('#x') and len (sexp) == 10:
+		return int (sexp[2:], 16)
+	if sexp.startswith ('#b') and len (sexp) == 34:
+		return int (sexp[2:], 2)
+	return None
+
+def pvalid_range_pieces (rng):
+	"""the range (see pvalid_range) as intervals [start, end) of
+	offsets from its base, split in two if it wraps past 2 ** 32."""
+	(_, offs, size) = rng
+	end = offs + size
+	if end <= 2 ** 32:
+		return [(offs, end)]
+	return [(offs, 2 ** 32), (0, end - 2 ** 32)]
+
+class PValidIndex:
+	"""the pvalids of one heap type description, with those of known
+	range (see pvalid_range) kept sorted by start offset for each base.
+	a valid object does not wrap around, so two pvalids with the same
+	base and disjoint ranges are disjoint if both are valid, and the
+	pvalid assertions relating them hold trivially. candidates gives
+	just the pvalids a new one must be related to, without visiting
+	the disjoint ones."""
+	def __init__ (self):
+		self.keys = []
+		self.unranged = []
+		self.bases = {}
+
+	def __len__ (self):
+		return len (self.keys)
+
+	def add (self, key, rng):
+		i = len (self.keys)
+		self.keys.append (key)
+		if rng == None:
+			self.unranged.append (i)
+			return
+		(base, _, size) = rng
+		(starts, max_size) = self.bases.setdefault (base, ([], [0]))
+		for (start, end) in pvalid_range_pieces (rng):
+			bisect.insort (starts, (start, end, i))
+		max_size[0] = max (max_size[0], size)
+
+	def candidates (self, rng):
+		"""the pvalids which may overlap range rng, in the order
+		they were added."""
+		if rng == None:
+			return list (self.keys)
+		(base, _, _) = rng
+		found = set (self.unranged)
+		for (base2, (starts, _)) in self.bases.iteritems ():
+			if base2 != base:
+				found.update ([i for (_, _, i) in starts])
+		if base in self.bases:
+			(starts, max_size) = self.bases[base]
+			for (start, end) in pvalid_range_pieces (rng):
+				j = bisect.bisect_left (starts,
+					(start - max_size[0] + 1, ))
+				while j < len (starts) and starts[j][0] < end:
+					if starts[j][1] > start:
+						found.add (starts[j][2])
+					j += 1
+		return [self.keys[i] for i in sorted (found)]
+
+pvalid_types_nest_memo = {}
+
+def pvalid_types_nest (typ, typ2):
+	"""whether either type can be strictly contained in the other. if
+	not, the second pvalid assertion is trivially true."""
+	k = (typ, typ2)
+	if k not in pvalid_types_nest_memo:
+		pvalid_types_nest_memo[k] = bool (
+			get_styp_condition_inner1 (typ, typ2)
+			or get_styp_condition_inner1 (typ2, typ))
+	return pvalid_types_nest_memo[k]
+
 def smt_to_val (s, toplevel = None):
 	stores = []
 	if len (s) == 3 and s[0] == '_' and s[1][:2] == 'bv':
@@ -1730,6 +3740,41 @@ def eval_mem_names (m, defs, mem_names):
 		else:
 			stack.extend ([m_var, pred])
 
+class LazyModel (dict):
+	"""a model which the solver only fetches for the cone of influence
+	of the given expressions (Exprs in the empty environment, or SMT
+	strings). any other value the solver knows of is fetched on
+	demand when it's first looked up, by repeating the query with
+	the values already fetched held fixed."""
+	def __init__ (self, exprs):
+		dict.__init__ (self)
+		self.exprs = list (exprs)
+		self.solv = None
+		self.hyps = None
+		self.fetched = None
+		self.complete = False
+
+	def fetch_missing (self, x):
+		if self.complete or self.fetched == None:
+			return False
+		if not self.solv.in_model (x):
+			return False
+		self.complete = True
+		return self.solv.fetch_rest_of_model (self, x)
+
+	def __contains__ (self, x):
+		return (dict.__contains__ (self, x)
+			or (self.fetch_missing (x) and dict.__contains__ (self, x)))
+
+	def __missing__ (self, x):
+		if self.fetch_missing (x) and dict.__contains__ (self, x):
+			return dict.__getitem__ (self, x)
+		raise KeyError (x)
+
+def note_lazy_model_fetched (model):
+	if isinstance (model, LazyModel) and model.fetched == None:
+		model.fetched = model.keys ()
+
 def make_model (sexp, m, abbrvs = [], mem_defs = {}):
 	last_primitive_model[0] = (sexp, abbrvs)
 	m_pre = {}
@@ -1751,10 +3796,27 @@ def make_model (sexp, m, abbrvs = [], mem_defs = {}):
 	return True
 
 def flat_s_expression (s):
-	if type(s) == tuple:
-		return '(' + ' '.join (map (flat_s_expression, s)) + ')'
-	else:
+	if type (s) != tuple:
 		return s
+	# explicit stack of (iterator, first element) pairs for each
+	# level, as for parse_s_expression_bits
+	bits = ['(']
+	stack = [[iter (s), True]]
+	while stack:
+		level = stack[-1]
+		for x in level[0]:
+			if not level[1]:
+				bits.append (' ')
+			level[1] = False
+			if type (x) == tuple:
+				bits.append ('(')
+				stack.append ([iter (x), True])
+				break
+			bits.append (x)
+		else:
+			stack.pop ()
+			bits.append (')')
+	return ''.join (bits)
 
 pvalid_type_map = {}
 
@@ -1777,11 +3839,140 @@ def quick_test (force_solv = False):
 		force_solv = fs) == 'sat'
 	assert m == {'v': z}, m
 
+def shared_term_test ():
+	"""check that a term long enough to be named by smt_expr (see
+	smt_expr_share_len) can still be evaluated in a model."""
+	import search
+	solv = Solver ()
+	vs = [syntax.mk_var ('v%d' % i, word32T) for i in range (40)]
+	env = dict ([((v.name, v.typ), solv.add_var (v.name, v.typ))
+		for v in vs])
+	total = reduce (syntax.mk_plus, vs)
+	sexp = smt_expr (total, env, solv)
+	assert [nm for nm in solv.defs if nm.startswith ('shared')], sexp
+	m = {}
+	assert solv.hyps_sat_raw ([], model = m) == 'sat'
+	x = search.eval_model_expr (m, solv, mk_smt_expr (sexp, word32T))
+	assert x.kind == 'Num' and x.typ == word32T, x
+
+# a stand-in online solver for portfolio_test. it acknowledges each
+# command, and answers each (check-sat) with argv[2] after argv[1] seconds.
+fake_solver_script = '''
+import sys, time
+depth = 0
+while True:
+	line = sys.stdin.readline ()
+	if not line:
+		break
+	depth += line.count ('(') - line.count (')')
+	if depth or not line.strip ():
+		continue
+	if '(check-sat)' in line:
+		time.sleep (float (sys.argv[1]))
+		print sys.argv[2]
+	else:
+		print 'success'
+	sys.stdout.flush ()
+'''
+
+def fake_solver (name, delay, answer):
+	return SolverImpl (name, True, [sys.executable, '-c',
+		fake_solver_script, str (delay), answer], 30)
+
+def portfolio_test ():
+	"""race two stand-in solvers of different latencies. the fast
+	one wins, and the slow one is settled and used again."""
+	slow = fake_solver ('slow', 1.0, 'sat')
+	fast = fake_solver ('fast', 0, 'unsat')
+	solv = Solver ()
+	(solv.fast_solver, solv.fast_solvers) = (slow, [slow, fast])
+	(res, _, _, _) = solv.portfolio_sat_raw_inner (['true'], False)
+	assert res == 'unsat', res
+	loser = solv.online_solver
+	assert loser.portfolio_pending
+	# the loser is still busy, so it sits out the next race
+	(res, _, _, _) = solv.portfolio_sat_raw_inner (['true'], False)
+	assert res == 'unsat', res
+	assert solv.settle_portfolio_loser (slow, loser, True)
+	assert solv.online_solver == loser and not loser.portfolio_pending
+	(res, _, _, _) = solv.hyps_sat_raw_inner (['true'], False, None)
+	assert res == 'sat', res
+	solv.close (reuse = False)
+
+	# if every solver fails, the query fails
+	bad = [fake_solver ('bad%d' % i, 0, '(error "fake")')
+		for i in range (2)]
+	solv = Solver ()
+	(solv.fast_solver, solv.fast_solvers) = (bad[0], bad)
+	try:
+		solv.portfolio_sat_raw_inner (['true'], False)
+		assert not 'portfolio failure raised'
+	except ConversationProblem, e:
+		assert len (e.response) == 2, e.response
+	assert solv.online_solver == None and not solv.portfolio_solvers
+	solv.close (reuse = False)
+
 def test ():
 	quick_test ()
+	shared_term_test ()
+	portfolio_test ()
 	quick_test (force_solv = 'Slow')
 	print 'Solver self-test successful'
 
+def bench_s_expressions (fname, repeats = 5):
+	"""time reading and printing the recorded model responses in
+	fname (see model_response_log)."""
+	models = [l.strip () for l in open (fname) if l.strip ()]
+	size = sum ([len (l) for l in models])
+	print 'benchmarking %d responses, %d bytes' % (len (models), size)
+	for i in range (repeats):
+		start = time.time ()
+		proc = subprocess.Popen (['cat', fname], stdout = subprocess.PIPE)
+		stream = SolverOutput (proc.stdout)
+		sexps = [get_s_expression (stream, 'bench') for l in models]
+		stream.close ()
+		proc.wait ()
+		read_time = time.time () - start
+		start = time.time ()
+		for sexp in sexps:
+			flat_s_expression (sexp)
+		flat_time = time.time () - start
+		print '  read+parse %.3fs, flatten %.3fs' % (read_time,
+			flat_time)
+
+def telemetry_report (fname):
+	"""summarise a telemetry_log file by phase and by solver."""
+	import json
+	rows = [json.loads (l) for l in open (fname) if l.strip ()]
+	print '%d solver events in %s' % (len (rows), fname)
+	tables = [('phase', lambda r: (r['phase'], r['event'])),
+		('origin', lambda r: (r.get ('origin'), r['event'])),
+		('solver', lambda r: (r['event'], r['solver'],
+			r['strategy']))]
+	for (title, key) in tables:
+		groups = {}
+		for r in rows:
+			groups.setdefault (key (r), []).append (r)
+		print
+		print 'by %s:' % title
+		print '  %-44s %6s %9s %8s %9s %9s  %s' % ('', 'count',
+			'wall', 'max', 'cpu', 'kbytes', 'results')
+		order = sorted (groups, key = lambda k: - sum ([r['wall']
+			for r in groups[k]]))
+		for k in order:
+			rs = groups[k]
+			results = {}
+			for r in rs:
+				results[r['result']] = results.get (r['result'], 0) + 1
+			print '  %-44s %6d %9.2f %8.2f %9.2f %9d  %s' % (
+				' '.join ([str (x) for x in k]), len (rs),
+				sum ([r['wall'] for r in rs]),
+				max ([r['wall'] for r in rs]),
+				sum ([r['cpu'] or 0.0 for r in rs]),
+				sum ([r['bytes'] or 0 for r in rs]) / 1024,
+				', '.join (['%s %d' % (res, n) for (res, n)
+					in sorted (results.items ())]))
+
 if __name__ == "__main__":
 	import sys, target_objects
 	if sys.argv[1:] == ['testq']:
@@ -1789,5 +3980,11 @@ if __name__ == "__main__":
 		test ()
 	elif sys.argv[1:] == ['test']:
 		test ()
+	elif sys.argv[1:2] == ['bench-sexp']:
+		for fname in sys.argv[2:]:
+			bench_s_expressions (fname)
+	elif sys.argv[1:2] == ['report']:
+		for fname in sys.argv[2:]:
+			telemetry_report (fname)
 
 
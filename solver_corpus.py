@@ -0,0 +1,232 @@
+# * Copyright 2015, NICTA
+# *
+# * This software may be distributed and modified according to the terms of
+# * the BSD 2-Clause license. Note that NO WARRANTY is provided.
+# * See "LICENSE_BSD2.txt" for details.
+# *
+# * @TAG(NICTA_BSD)
+
+# run every solver in .solverlist over the corpus of difficult queries
+# saved by graph-refine (the 'save-smt-examples:SECS' option, see
+# solver.save_solv_example), and compare them with each other and with
+# the time and result recorded when each query was saved. usage:
+#   python solver_corpus.py DIR [jobs:N] [timeout:SECS] [solvers:A,B]
+#       [results:FILE]
+
+import solver
+import os
+import sys
+import json
+import time
+import threading
+
+# a solver answering in under the reference time over speedup_factor is
+# counted as a speed-up, and one taking over speedup_factor times the
+# reference time (or failing to answer) as a regression. differences of
+# under speedup_min_seconds are ignored as noise.
+speedup_factor = 2.0
+speedup_min_seconds = 1.0
+
+def load_corpus (dname):
+	"""the examples in dname, with their metadata. examples saved
+	before metadata was kept have only their reference time."""
+	examples = []
+	for fname in sorted (os.listdir (dname)):
+		if fname.endswith ('.json') or not fname.startswith ('ex_'):
+			continue
+		path = os.path.join (dname, fname)
+		meta = {}
+		if os.path.exists (path + '.json'):
+			meta = json.loads (open (path + '.json').read ())
+		else:
+			l = open (path).readline ()
+			bits = l.split ()
+			if bits[:3] == [';', 'reference', 'time']:
+				meta['reference_time'] = float (bits[3])
+		examples.append ((fname, path, meta))
+	return examples
+
+def run_example (path, impl, timeout):
+	"""run one solver on one example, returning (result, wall, cpu)."""
+	script = open (path).read ()
+	start = time.time ()
+	proc = solver.start_solver_process (impl.args, timeout)
+	writer = threading.Thread (target = solver.write_solver_input,
+		args = (proc.stdin, [script]))
+	writer.daemon = True
+	writer.start ()
+	result = proc.stdout.readline ().strip ()
+	wall = time.time () - start
+	proc.stdout.close ()
+	(_, status, usage) = os.wait4 (proc.pid, 0)
+	proc.returncode = status
+	if result not in ['sat', 'unsat']:
+		result = result or 'none'
+	return (result, wall, usage.ru_utime + usage.ru_stime)
+
+def run_corpus (examples, impls, jobs, timeout):
+	"""run each solver on each example, jobs at a time."""
+	work = [(ex, impl) for ex in examples for impl in impls]
+	work.reverse ()
+	results = {}
+	lock = threading.Lock ()
+	def worker ():
+		while True:
+			lock.acquire ()
+			if not work:
+				lock.release ()
+				return
+			((fname, path, meta), impl) = work.pop ()
+			lock.release ()
+			t = timeout
+			if t == None:
+				t = impl.timeout
+			r = run_example (path, impl, t)
+			lock.acquire ()
+			results[(fname, impl.name)] = r
+			print '  %s %s: %s %.2fs' % (fname, impl.name, r[0], r[1])
+			sys.stdout.flush ()
+			lock.release ()
+	threads = [threading.Thread (target = worker) for i in range (jobs)]
+	for th in threads:
+		th.start ()
+	for th in threads:
+		th.join ()
+	return results
+
+def answers (fname, meta, impls, results):
+	ans = {}
+	if meta.get ('expected') in ['sat', 'unsat']:
+		ans['recorded (%s)' % meta.get ('solver')] = meta['expected']
+	for impl in impls:
+		(res, _, _) = results[(fname, impl.name)]
+		if res in ['sat', 'unsat']:
+			ans[impl.name] = res
+	return ans
+
+def report (examples, impls, results):
+	print
+	print '%d examples, %d solvers' % (len (examples), len (impls))
+	disagreements = []
+	speedups = {}
+	regressions = {}
+	fastest = {}
+	for (fname, path, meta) in examples:
+		ans = answers (fname, meta, impls, results)
+		if len (set (ans.values ())) > 1:
+			disagreements.append ((fname, ans))
+		ref = meta.get ('reference_time')
+		expected = meta.get ('expected')
+		answered = [(results[(fname, impl.name)][1], impl.name)
+			for impl in impls
+			if results[(fname, impl.name)][0] in ['sat', 'unsat']]
+		if answered:
+			name = min (answered)[1]
+			fastest[name] = fastest.get (name, 0) + 1
+		if ref == None:
+			continue
+		for impl in impls:
+			(res, wall, _) = results[(fname, impl.name)]
+			noise = abs (wall - ref) < speedup_min_seconds
+			if res in ['sat', 'unsat'] and wall * speedup_factor < ref:
+				if not noise:
+					speedups.setdefault (impl.name, []
+						).append ((fname, ref, wall))
+			elif ((wall > ref * speedup_factor and not noise)
+					or (res not in ['sat', 'unsat']
+						and expected in ['sat', 'unsat'])):
+				regressions.setdefault (impl.name, []).append (
+					(fname, ref, wall, res))
+
+	print
+	print '  %-30s %6s %6s %6s %8s %9s %9s %8s %8s' % ('solver',
+		'sat', 'unsat', 'other', 'fastest', 'wall', 'cpu',
+		'speedups', 'regress')
+	for impl in impls:
+		rs = [results[(fname, impl.name)]
+			for (fname, _, _) in examples]
+		counts = {}
+		for (res, _, _) in rs:
+			if res not in ['sat', 'unsat']:
+				res = 'other'
+			counts[res] = counts.get (res, 0) + 1
+		print '  %-30s %6d %6d %6d %8d %9.2f %9.2f %8d %8d' % (
+			impl.name, counts.get ('sat', 0),
+			counts.get ('unsat', 0), counts.get ('other', 0),
+			fastest.get (impl.name, 0),
+			sum ([wall for (_, wall, _) in rs]),
+			sum ([cpu for (_, _, cpu) in rs]),
+			len (speedups.get (impl.name, [])),
+			len (regressions.get (impl.name, [])))
+
+	for impl in impls:
+		if impl.name in speedups:
+			print
+			print 'speed-ups for %s:' % impl.name
+			for (fname, ref, wall) in speedups[impl.name]:
+				print '  %s: %.2fs (was %.2fs)' % (fname, wall, ref)
+		if impl.name in regressions:
+			print
+			print 'regressions for %s:' % impl.name
+			for (fname, ref, wall, res) in regressions[impl.name]:
+				print '  %s: %s %.2fs (was %.2fs)' % (fname, res,
+					wall, ref)
+	if disagreements:
+		print
+		print 'DISAGREEMENTS:'
+		for (fname, ans) in disagreements:
+			print '  %s: %s' % (fname, ', '.join (['%s %s'
+				% (name, res) for (name, res)
+				in sorted (ans.items ())]))
+
+def save_results (fname, examples, impls, results):
+	f = open (fname, 'a')
+	for (ex, path, meta) in examples:
+		for impl in impls:
+			(res, wall, cpu) = results[(ex, impl.name)]
+			f.write (json.dumps ({'example': ex,
+				'solver': impl.name, 'args': impl.args,
+				'result': res, 'wall': wall, 'cpu': cpu,
+				'reference_time': meta.get ('reference_time'),
+				'expected': meta.get ('expected')},
+				sort_keys = True) + '\n')
+	f.close ()
+
+def main (args):
+	if not args:
+		print 'usage: solver_corpus.py DIR [jobs:N] [timeout:SECS]'
+		print '    [solvers:NAME,NAME ..] [results:FILE]'
+		sys.exit (1)
+	dname = args[0]
+	jobs = solver.num_parallel_solvers ()
+	timeout = None
+	names = None
+	results_file = None
+	for arg in args[1:]:
+		(opt, v) = arg.split (':', 1)
+		if opt == 'jobs':
+			jobs = int (v)
+		elif opt == 'timeout':
+			timeout = int (v)
+		elif opt == 'solvers':
+			names = v.split (',')
+		elif opt == 'results':
+			results_file = v
+		else:
+			print 'solver_corpus.py: unknown option %r' % arg
+			sys.exit (1)
+	(impls, _) = solver.get_solver_set ()
+	impls = [impl for impl in impls if impl.transcript != 'replay']
+	if names != None:
+		impls = [impl for impl in impls if impl.origname in names
+			or impl.name in names]
+	examples = load_corpus (dname)
+	print 'running %d solvers on %d examples, %d at a time' % (
+		len (impls), len (examples), jobs)
+	results = run_corpus (examples, impls, jobs, timeout)
+	report (examples, impls, results)
+	if results_file:
+		save_results (results_file, examples, impls, results)
+
+if __name__ == '__main__':
+	main (sys.argv[1:])
@@ -0,0 +1,288 @@
+# * Copyright 2015, NICTA
+# *
+# * This software may be distributed and modified according to the terms of
+# * the BSD 2-Clause license. Note that NO WARRANTY is provided.
+# * See "LICENSE_BSD2.txt" for details.
+# *
+# * @TAG(NICTA_BSD)
+
+# record and replay SMT solver conversations. solver.py runs this in place
+# of a solver for .solverlist lines of the forms
+#   Z3: online: record /some/dir /path/to/z3 -t:2 -smt2 -in
+#   Z3: online: replay /some/dir
+# in record mode the real solver is run behind a proxy, and each response
+# is saved, keyed by the solver name, the command and the assertions in
+# force in the solver when it was given (those on the push/pop stack).
+# graph-refine doesn't always emit the same commands in the same order from
+# run to run, so the key ignores the order of the commands at each level
+# and their :named labels. definitions and declarations are part of the key
+# like assertions, since a query's answer (and a model's values) can
+# depend on them. in replay mode the responses are answered from the saved
+# transcripts without running any solver, which makes the runs of
+# graph-refine repeatable and free of solver time.
+# where solvers race (see race_log_name in solver.py) graph-refine logs the
+# winners in record mode, and in replay mode follows the log rather than
+# the order the replayed answers happen to arrive in.
+# a command with no recorded response gets miss_response, which solver.py
+# reports as a ReplayMiss rather than guessing an answer.
+
+import sys
+import os
+import re
+import hashlib
+import json
+import subprocess
+
+response_cmds = set (['check-sat', 'check-sat-assuming', 'get-value',
+	'get-model', 'get-unsat-core', 'get-assertions', 'get-assignment',
+	'get-info', 'get-option', 'get-proof', 'echo'])
+
+special_re = re.compile (r'[()"|;]')
+named_re = re.compile (r':named\s+[^\s()]+')
+atom_end_re = re.compile (r'[\s()]')
+
+class SExpReader:
+	"""splits a stream into top-level s-expressions, returning each
+	with its text. strings, |quoted symbols| and comments are allowed
+	for, and the stream is read in chunks."""
+	def __init__ (self, fd):
+		self.fd = fd
+		self.buf = ''
+		self.eof = False
+
+	def fill (self):
+		chunk = os.read (self.fd, 65536)
+		if not chunk:
+			self.eof = True
+		self.buf += chunk
+
+	def read (self):
+		"""the next s-expression (or atom) as text, or None at the
+		end of the stream."""
+		i = 0
+		depth = 0
+		start = None
+		while True:
+			if i >= len (self.buf):
+				if self.eof:
+					self.buf = ''
+					return None
+				self.fill ()
+				continue
+			if start == None:
+				if self.buf[i].isspace ():
+					i += 1
+					continue
+				start = i
+			c = self.buf[i]
+			if depth == 0 and c not in '(;':
+				# an atom, up to whitespace or a bracket
+				m = atom_end_re.search (self.buf, i)
+				if m == None and not self.eof:
+					self.fill ()
+					continue
+				j = m.start () if m else len (self.buf)
+				text = self.buf[start:j]
+				self.buf = self.buf[j:]
+				return text
+			m = special_re.search (self.buf, i)
+			if m == None:
+				i = len (self.buf)
+				continue
+			i = m.start ()
+			c = self.buf[i]
+			if c in '"|;':
+				end = {'"': '"', '|': '|', ';': '\n'}[c]
+				j = self.buf.find (end, i + 1)
+				while j < 0 and not self.eof:
+					self.fill ()
+					j = self.buf.find (end, i + 1)
+				if j < 0:
+					j = len (self.buf) - 1
+				if c == ';' and depth == 0:
+					start = None
+				i = j + 1
+				continue
+			if c == '(':
+				depth += 1
+			else:
+				depth -= 1
+			i += 1
+			if depth == 0:
+				text = self.buf[start:i]
+				self.buf = self.buf[i:]
+				return text
+
+def cmd_name (cmd):
+	bits = cmd[1:].split (None, 1)
+	if cmd.startswith ('(') and bits:
+		return bits[0].rstrip (')')
+	return None
+
+def top_level_items (s):
+	items = []
+	item = []
+	depth = 0
+	for c in s:
+		if depth == 0 and c.isspace ():
+			if item:
+				items.append (''.join (item))
+			item = []
+			continue
+		item.append (c)
+		if c == '(':
+			depth += 1
+		elif c == ')':
+			depth -= 1
+	if item:
+		items.append (''.join (item))
+	return items
+
+def cmd_hash (cmd):
+	"""a hash of a command, ignoring :named labels and the order of
+	the terms asked for by get-value."""
+	cmd = named_re.sub (':named', cmd)
+	if cmd_name (cmd) == 'get-value':
+		terms = cmd[len ('(get-value') : -1].strip ()[1:-1]
+		cmd = '(get-value (%s))' % ' '.join (sorted (
+			top_level_items (terms)))
+	return long (hashlib.sha1 (cmd).hexdigest (), 16)
+
+class Conversation:
+	"""tracks which commands of a conversation get a response, and the
+	key of each response. the assertions in force are summarised by the
+	sum of their hashes at each level of the push/pop stack."""
+	def __init__ (self, name):
+		self.levels = [cmd_hash (name)]
+		self.print_success = False
+
+	def command (self, cmd):
+		"""note a command, returning (response expected, key). the key
+		is None for a command which just gets 'success'."""
+		name = cmd_name (cmd)
+		bits = cmd.strip ('()').split ()
+		n = 1
+		if len (bits) > 1 and bits[1].isdigit ():
+			n = int (bits[1])
+		k = None
+		if name in response_cmds:
+			h = cmd_hash (cmd)
+			k = '%040x' % ((sum (self.levels) + h) % (2 ** 160))
+		if name == 'push':
+			self.levels.extend ([0] * n)
+		elif name == 'pop':
+			self.levels[max (1, len (self.levels) - n):] = []
+		elif k == None:
+			self.levels[-1] += cmd_hash (cmd)
+		if name == 'set-option' and ':print-success' in cmd:
+			self.print_success = 'true' in cmd.split ()[-1]
+		if name == 'exit':
+			return (False, None)
+		return (self.print_success or k != None, k)
+
+def load_transcripts (dname):
+	"""the recorded responses for each key, in the order recorded. a
+	solver may give different answers (e.g. models) to the same query
+	at different times, and replay gives them back in the same order."""
+	responses = {}
+	if not os.path.isdir (dname):
+		return responses
+	fnames = [os.path.join (dname, fname)
+		for fname in os.listdir (dname) if fname.endswith ('.jsonl')]
+	fnames.sort (key = os.path.getmtime)
+	for fname in fnames:
+		for l in open (fname):
+			try:
+				(k, response) = json.loads (l)
+			except ValueError:
+				# a transcript cut short by a killed solver
+				continue
+			responses.setdefault (k, []).append (response)
+	return responses
+
+# the start of the response to a command with no recorded response. the
+# rest of the response names the command.
+miss_response = '(error "solver_replay: no recorded response'
+
+def reply (response):
+	try:
+		sys.stdout.write (response + '\n')
+		sys.stdout.flush ()
+	except IOError, e:
+		# the solver has been stopped
+		sys.exit (0)
+
+def replay (dname, name):
+	responses = load_transcripts (dname)
+	conv = Conversation (name)
+	reader = SExpReader (sys.stdin.fileno ())
+	while True:
+		cmd = reader.read ()
+		if cmd == None:
+			break
+		(expect, k) = conv.command (cmd)
+		if not expect:
+			continue
+		if k == None:
+			reply ('success')
+			continue
+		if k in responses:
+			rs = responses[k]
+			reply (rs[0])
+			if len (rs) > 1:
+				rs.pop (0)
+			continue
+		cmd = ' '.join (cmd[:200].split ()).replace ('"', '""')
+		reply ('%s for %s to %s")' % (miss_response, name, cmd))
+
+def record (dname, name, args):
+	if not os.path.isdir (dname):
+		try:
+			os.makedirs (dname)
+		except OSError:
+			pass
+	f = open (os.path.join (dname, '%s-%d.jsonl'
+		% (name.replace (' ', '_'), os.getpid ())), 'a')
+	proc = subprocess.Popen (args, stdin = subprocess.PIPE,
+		stdout = subprocess.PIPE)
+	solver_out = SExpReader (proc.stdout.fileno ())
+	conv = Conversation (name)
+	reader = SExpReader (sys.stdin.fileno ())
+	while True:
+		cmd = reader.read ()
+		if cmd == None:
+			break
+		(expect, k) = conv.command (cmd)
+		try:
+			proc.stdin.write (cmd + '\n')
+			proc.stdin.flush ()
+		except IOError, e:
+			break
+		if not expect:
+			continue
+		response = solver_out.read ()
+		if response == None:
+			break
+		if k != None:
+			f.write (json.dumps ([k, response]) + '\n')
+			f.flush ()
+		reply (response)
+	proc.stdin.close ()
+	# pass on anything else the solver says, e.g. an error at the end
+	# of an offline script
+	rest = solver_out.read ()
+	while rest != None:
+		reply (rest)
+		rest = solver_out.read ()
+	f.close ()
+	proc.wait ()
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['replay'] and len (sys.argv) == 4:
+		replay (sys.argv[2], sys.argv[3])
+	elif sys.argv[1:2] == ['record'] and len (sys.argv) > 4:
+		record (sys.argv[2], sys.argv[3], sys.argv[4:])
+	else:
+		print 'usage: solver_replay.py replay DIR NAME'
+		print '       solver_replay.py record DIR NAME COMMAND ..'
+		sys.exit (1)
@@ -1030,19 +1030,34 @@ def compute_stack_bounds (quiet = False):
 	return bounds
 
 def read_fn_hash (fname):
+	"""the hash of the functions at the head of a stack bounds file,
+	and the hash of the files they were loaded from, or None."""
 	try:
 		f = open (fname)
 		s = f.readline ()
 		bits = s.split ()
-		if bits[0] != 'FunctionHash' or len (bits) != 2:
-			return None
-		return int (bits[1])
+		if bits[0] != 'FunctionHash' or len (bits) not in [2, 4]:
+			return (None, None)
+		if len (bits) == 4 and bits[2] != 'InputHash':
+			return (None, None)
+		return (int (bits[1]), (bits[3:] or [None])[0])
 	except ValueError, e:
-		return None
+		return (None, None)
 	except IndexError, e:
-		return None
+		return (None, None)
 	except IOError, e:
+		return (None, None)
+
+def function_input_hash ():
+	"""the sha1 of the files the functions were loaded from, or None
+	if they weren't loaded from files."""
+	if not target_objects.function_files:
 		return None
+	import hashlib
+	h = hashlib.sha1 ()
+	for fname in target_objects.function_files:
+		h.update (target_objects.file_hash (fname))
+	return h.hexdigest ()
 
 def mk_stack_pairings (pairing_tups, stack_bounds_fname = None,
 		quiet = True):
@@ -1059,9 +1074,17 @@ def mk_stack_pairings (pairing_tups, stack_bounds_fname = None,
 		pre_pairings[c_f] = pair
 		pre_pairings[asm_f] = pair
 	
-	fn_hash = hash (tuple (sorted ([(f, hash (functions[f]))
-		for f in functions])))
-	prev_hash = read_fn_hash (stack_bounds_fname)
+	(prev_hash, prev_input_hash) = read_fn_hash (stack_bounds_fname)
+	input_hash = function_input_hash ()
+	if (prev_hash != None and input_hash == prev_input_hash != None
+			and not all ([functions[f].is_loaded ()
+				for f in functions])):
+		# the functions come from the same files as last time, and
+		# computing their hash would load every one of them
+		fn_hash = prev_hash
+	else:
+		fn_hash = hash (tuple (sorted ([(f, hash (functions[f]))
+			for f in functions])))
 	if prev_hash == fn_hash:
 		f = open (stack_bounds_fname)
 		f.readline ()
@@ -1070,8 +1093,13 @@ def mk_stack_pairings (pairing_tups, stack_bounds_fname = None,
 	else:
 		printout ('Computing stack bounds.')
 		stack_bounds = compute_stack_bounds (quiet = quiet)
+	if prev_hash != fn_hash or input_hash not in [None, prev_input_hash]:
 		f = open (stack_bounds_fname, 'w')
-		f.write ('FunctionHash %s\n' % fn_hash)
+		if input_hash != None:
+			f.write ('FunctionHash %s InputHash %s\n'
+				% (fn_hash, input_hash))
+		else:
+			f.write ('FunctionHash %s\n' % fn_hash)
 		for line in serialise_stack_bounds (stack_bounds):
 			f.write(line)
 		f.close ()
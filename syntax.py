@@ -11,6 +11,7 @@
 
 from target_objects import structs, trace
 import target_objects
+import sys
 
 quick_reference = """
 Quick reference on the graph language and its syntax.
@@ -255,6 +256,7 @@ standard.
 
 class Type:
 	def __init__ (self, kind, name, el_typ=None):
+		self.hashed = None
 		self.kind = kind
 		if kind in ['Array', 'Word']:
 			self.num = int (name)
@@ -281,6 +283,8 @@ class Type:
 			return 'Type (%r, %r)' % (self.kind, self.name)
 
 	def __eq__ (self, other):
+		if self is other:
+			return True
 		if not other:
 			return False
 		if self.kind != other.kind:
@@ -303,7 +307,10 @@ class Type:
 		return not other or not (self == other)
 
 	def __hash__ (self):
-		return hash(str(self))
+		# types are never changed once made, so the hash is kept
+		if self.hashed == None:
+			self.hashed = hash (str (self))
+		return self.hashed
 
 	def __cmp__ (self, other):
 		self_ss = []
@@ -371,9 +378,16 @@ class Type:
 		else:
 			assert not 'type serialisable', self.kind
 
-class Expr:
+class Expr (object):
+	# there are millions of expressions in a large target, so they are
+	# kept without a __dict__. the fields not used by an expression's
+	# kind are left unset, and reading them raises AttributeError.
+	__slots__ = ['hashed', 'kind', 'typ', 'name', 'struct', 'field',
+		'val', 'vals']
+
 	def __init__ (self, kind, typ, name = None, struct = None,
 			field = None, val = None, vals = None):
+		self.hashed = None
 		self.kind = kind
 		self.typ = typ
 		if name != None:
@@ -421,6 +435,11 @@ class Expr:
 		return 'Expr (%s)' % ', '.join(bits)
 
 	def __eq__ (self, other):
+		if self is other:
+			return True
+		if (self.hashed != None and getattr (other, 'hashed', None)
+				not in [None, self.hashed]):
+			return False
 		return (other and self.kind == other.kind
 			and self.typ == other.typ
 			and self.binds() == other.binds())
@@ -429,7 +448,13 @@ class Expr:
 		return not other or not (self == other)
 
 	def __hash__ (self):
-		return hash_tuplify (self.kind, self.typ, self.binds ())
+		# expressions are never changed once made (they are rebuilt
+		# by subst etc) so the hash is kept. the hashes of the
+		# subexpressions are kept too, so this is not recursive.
+		if self.hashed == None:
+			self.hashed = hash_tuplify (self.kind, self.typ,
+				self.binds ())
+		return self.hashed
 
 	def __cmp__ (self, other):
 		return cmp ((self.kind, self.typ, self.binds ()),
@@ -573,7 +598,7 @@ def tuplify (x):
 	if type(x) == tuple or type(x) == list:
 		return tuple ([tuplify (y) for y in x])
 	if type(x) == dict:
-		return tuple ([tuplify (y) for y in x.iteritems ()])
+		return tuple (sorted ([tuplify (y) for y in x.iteritems ()]))
 	else:
 		return x
 
@@ -591,8 +616,12 @@ def subst_list (substor, xs, ss = None):
 	else:
 		return
 
-class Node:
+class Node (object):
+	__slots__ = ['hashed', 'kind', 'cont', 'upds', 'fname', 'args',
+		'rets', 'left', 'right', 'cond']
+
 	def __init__ (self, kind, conts, args):
+		self.hashed = None
 		self.kind = kind
 
 		if type (conts) == list:
@@ -618,18 +647,31 @@ class Node:
 		return 'Node (%r, %r, %r)' % (self.kind,
 			self.get_conts (), self.get_args ())
 
+	def __setattr__ (self, name, val):
+		# nodes are changed in place by e.g. Problem.redirect_conts,
+		# which must forget the hash
+		object.__setattr__ (self, name, val)
+		if name != 'hashed':
+			object.__setattr__ (self, 'hashed', None)
+
 	def __hash__ (self):
+		if self.hashed != None:
+			return self.hashed
 		if self.kind == 'Call':
-			return hash ((self.fname, tuple (self.args),
+			h = hash ((self.fname, tuple (self.args),
 				tuple (self.rets), self.cont))
 		elif self.kind == 'Basic':
-			return hash (tuple (self.upds))
+			h = hash (tuple (self.upds))
 		elif self.kind == 'Cond':
-			return hash ((self.cond, self.left, self.right))
+			h = hash ((self.cond, self.left, self.right))
 		else:
 			assert not 'node kind understood', self.kind
+		self.hashed = h
+		return h
 
 	def __eq__ (self, other):
+		if self is other:
+			return True
 		return all ([self.kind == other.kind,
 			self.get_conts () == other.get_conts (),
 			self.get_args () == other.get_args ()])
@@ -855,6 +897,58 @@ class Function:
 		import problem
 		problem.save_graph (self.nodes, fname)
 
+	def is_loaded (self):
+		return True
+
+	def when_loaded (self, f):
+		"""call f on this function once its body is loaded (see
+		IndexedFunction)."""
+		f (self)
+
+class IndexedFunction (Function):
+	"""a function whose body has been found in a file by index_all but
+	not yet parsed. it is parsed when the nodes or entry point are
+	first needed."""
+	def __init__ (self, name, inputs, outputs, index):
+		self.name = name
+		self.inputs = inputs
+		self.outputs = outputs
+		self.index = index
+		self.load_hooks = []
+
+	def __getattr__ (self, name):
+		if name not in ['nodes', 'entry'] or self.is_loaded ():
+			raise AttributeError (name)
+		self.load ()
+		return self.__dict__[name]
+
+	def is_loaded (self):
+		return 'nodes' in self.__dict__
+
+	def when_loaded (self, f):
+		if self.is_loaded ():
+			f (self)
+		else:
+			self.load_hooks.append (f)
+
+	def load (self):
+		(fname, offset) = self.index
+		f = open (fname, 'rb')
+		f.seek (offset)
+		lines = []
+		for line in f:
+			lines.append (line)
+			if line.startswith ('EntryPoint'):
+				break
+		f.close ()
+		(_, functions, _) = parse_all (lines)
+		fun = functions[self.name]
+		self.nodes = fun.nodes
+		self.entry = fun.entry
+		(hooks, self.load_hooks) = (self.load_hooks, [])
+		for hook in hooks:
+			hook (self)
+
 def mk_builtinTs ():
 	return dict([(n, Type('Builtin', n)) for n
 	in 'Bool Mem Dom HTD PMS UNIT Type RelWrapper'.split()])
@@ -896,7 +990,19 @@ def parse_int (s):
 	else:
 		return int (s)
 
-def parse_typ(bits, n, symbolic_types = False):
+# structurally equal types and expressions loaded from a file are shared,
+# which saves memory and lets most comparisons succeed on identity.
+interned = {}
+
+def intern_obj (x):
+	"""the shared copy of a Type or Expr equal to x."""
+	return interned.setdefault (x, x)
+
+def parse_typ (bits, n, symbolic_types = False):
+	(n, typ) = parse_typ_inner (bits, n, symbolic_types)
+	return (n, intern_obj (typ))
+
+def parse_typ_inner (bits, n, symbolic_types):
 	if bits[n] == 'Word' or bits[n] == 'BitVec':
 		return (n + 2, Type('Word', parse_int (bits[n + 1])))
 	elif bits[n] == 'WordArray' or bits[n] == 'FloatingPoint':
@@ -994,6 +1100,10 @@ def parse_struct_elem (bits, n):
 	return (n, (name, val))
 
 def parse_expr (bits, n):
+	(n, expr) = parse_expr_inner (bits, n)
+	return (n, intern_obj (expr))
+
+def parse_expr_inner (bits, n):
 	if bits[n] in {'Symbol':True, 'Var':True, 'ConstGlobal':True}:
 		kind = bits[n]
 		name = bits[n + 1]
@@ -1135,8 +1245,132 @@ lines. See syntax.quick_reference for an explanation.'''
 
 	return (structs, functions, const_globals)
 
+def index_all (fname):
+	"""read a file as parse_all does, but without parsing the bodies
+	of the functions, which are installed as IndexedFunction objects
+	recording where each body is in the file."""
+	others = []
+	headers = []
+	offset = 0
+	f = open (fname, 'rb')
+	for line in f:
+		if line.startswith ('Function'):
+			headers.append ([line, offset, False])
+		elif line.startswith ('EntryPoint'):
+			headers[-1][2] = True
+		elif line.startswith ('Struct') or line.startswith ('Const'):
+			others.append (line)
+		offset += len (line)
+	f.close ()
+	(structs, functions, const_globals) = parse_all (others
+		+ [line for (line, _, _) in headers])
+	for (line, offset, has_body) in headers:
+		if has_body:
+			fun = functions[line.split ()[1]]
+			functions[fun.name] = IndexedFunction (fun.name,
+				fun.inputs, fun.outputs, (fname, offset))
+	return (structs, functions, const_globals)
+
+def load_and_install_all (fname, tag):
+	"""parse a file and install the results, or with the target argument
+	lazy-functions, index it, leaving the function bodies to be parsed
+	when they are used."""
+	target_objects.function_files.append (fname)
+	if 'lazy-functions' in target_objects.target_args:
+		return install_all (index_all (fname), tag)
+	f = open (fname)
+	result = parse_and_install_all (f, tag)
+	f.close ()
+	return result
+
 def parse_and_install_all (lines, tag):
-	(structs, functions, const_globals) = parse_all (lines)
+	processes = parse_processes ()
+	if processes > 1:
+		return install_all (parse_all_parallel (lines, processes), tag)
+	return install_all (parse_all (lines), tag)
+
+def parse_processes ():
+	"""the number of processes to parse with, set by the target argument
+	parallel-parse:N, or parallel-parse for one per CPU."""
+	for arg in target_objects.target_args:
+		if arg == 'parallel-parse':
+			import multiprocessing
+			return multiprocessing.cpu_count ()
+		elif arg.startswith ('parallel-parse:'):
+			return int (arg.split (':', 1)[1])
+	return 1
+
+parallel_parse_min_lines = [10000]
+
+def parse_chunk (lines, conn):
+	"""parse lines in a process forked by parse_all_parallel, sending
+	back the result and the trace output (or the exception)."""
+	traces = []
+	target_objects.tracer[0] = lambda s, push: traces.append ((s, push))
+	try:
+		result = (parse_all (lines), traces)
+	except Exception, e:
+		import traceback
+		result = ('Exception', traceback.format_exc ())
+	conn.send (result)
+	conn.close ()
+
+def parse_all_parallel (lines, processes):
+	"""parse_all, with the lines split into chunks (at the starts of
+	functions and structs) which are parsed in forked processes. the
+	results (and trace output) are merged in the order of the chunks,
+	so this gives the same results as parse_all, except that a function
+	defined in two chunks is an error, as a struct defined twice is."""
+	import os
+	lines = list (lines)
+	chunk_size = max (len (lines) / processes,
+		parallel_parse_min_lines[0])
+	chunks = []
+	start = 0
+	for (i, line) in enumerate (lines):
+		if i - start >= chunk_size and (line.startswith ('Function')
+				or line.startswith ('Struct ')):
+			chunks.append (lines[start:i])
+			start = i
+	chunks.append (lines[start:])
+	if len (chunks) == 1 or not hasattr (os, 'fork'):
+		return parse_all (lines)
+
+	# a Pool is not used, as its threads can deadlock with this one
+	# when this is run while a target is being imported
+	import multiprocessing
+	procs = []
+	for chunk in chunks:
+		(recv, send) = multiprocessing.Pipe (False)
+		proc = multiprocessing.Process (target = parse_chunk,
+			args = (chunk, send))
+		proc.start ()
+		send.close ()
+		procs.append ((proc, recv))
+	results = []
+	for (proc, recv) in procs:
+		results.append (recv.recv ())
+		recv.close ()
+		proc.join ()
+	for (result, traces) in results:
+		assert result != 'Exception', traces
+
+	structs = {}
+	functions = {}
+	const_globals = {}
+	for ((c_structs, c_functions, c_const_globals), traces) in results:
+		for (s, push) in traces:
+			trace (s, push)
+		for s in c_structs:
+			assert s not in structs, s
+		for f in c_functions:
+			assert f not in functions, f
+		structs.update (c_structs)
+		functions.update (c_functions)
+		const_globals.update (c_const_globals)
+	return (structs, functions, const_globals)
+
+def install_all ((structs, functions, const_globals), tag):
 	target_objects.structs.update (structs)
 	target_objects.functions.update (functions)
 	target_objects.const_globals.update (const_globals)
@@ -1222,27 +1456,32 @@ def check_cfg (fun):
 		fun.nodes[n2] = Node ('Basic', 'Err', [])
 
 def check_funs (functions, verbose = False):
-	for (f, fun) in functions.iteritems():
-		if not fun:
-			continue
+	def check (fun):
 		if verbose:
-			trace ('Checking %s' % f)
-		check_cfg (fun)
-		get_vars(fun)
-		for (n, node) in fun.nodes.iteritems():
-			if node.kind == 'Call':
-				c = functions[node.fname]
-				assert map(get_expr_typ, node.args) == \
-					map (get_lval_typ, c.inputs), (
-						 node.fname, node.args, c.inputs)
-				assert map (get_lval_typ, node.rets) == \
-					map (get_lval_typ, c.outputs), (
-						 node.fname, node.rets, c.outputs)
-			elif node.kind == 'Basic':
-				for (lv, v) in node.upds:
-					assert get_lval_typ(lv) == get_expr_typ(v)
-			elif node.kind == 'Cond':
-				assert get_expr_typ(node.cond) == boolT
+			trace ('Checking %s' % fun.name)
+		check_fun (fun, functions)
+	# functions which are not loaded yet are checked when loaded
+	for (f, fun) in functions.iteritems():
+		if fun:
+			fun.when_loaded (check)
+
+def check_fun (fun, functions):
+	check_cfg (fun)
+	get_vars(fun)
+	for (n, node) in fun.nodes.iteritems():
+		if node.kind == 'Call':
+			c = functions[node.fname]
+			assert map(get_expr_typ, node.args) == \
+				map (get_lval_typ, c.inputs), (
+					 node.fname, node.args, c.inputs)
+			assert map (get_lval_typ, node.rets) == \
+				map (get_lval_typ, c.outputs), (
+					 node.fname, node.rets, c.outputs)
+		elif node.kind == 'Basic':
+			for (lv, v) in node.upds:
+				assert get_lval_typ(lv) == get_expr_typ(v)
+		elif node.kind == 'Cond':
+			assert get_expr_typ(node.cond) == boolT
 
 def get_extensions (v):
 	extensions = set ()
@@ -1484,3 +1723,68 @@ def fresh_node (ns, hint = 1):
 		n += 16
 	return n
 
+
+def obj_size (x):
+	size = sys.getsizeof (x)
+	if hasattr (x, '__dict__'):
+		size += sys.getsizeof (x.__dict__)
+	return size
+
+def mem_report (functions):
+	"""the memory taken by the nodes of the loaded functions and the
+	expressions they refer to, counting each shared object once (names and numbers
+	are not counted)."""
+	seen = set ()
+	counts = {'Node': [0, 0], 'Expr': [0, 0], 'other': [0, 0]}
+	def add (x, kind):
+		if id (x) in seen:
+			return False
+		seen.add (id (x))
+		counts[kind][0] += 1
+		counts[kind][1] += obj_size (x)
+		return True
+	def add_expr (expr):
+		if not add (expr, 'Expr'):
+			return
+		add (expr.typ, 'other')
+		for (_, v) in expr.binds ():
+			if isinstance (v, Expr):
+				add_expr (v)
+			elif type (v) == list:
+				add (v, 'other')
+				for x in v:
+					add_expr (x)
+	for f in functions.itervalues ():
+		if not f.is_loaded ():
+			continue
+		for node in f.nodes.itervalues ():
+			add (node, 'Node')
+			if node.kind == 'Basic':
+				add (node.upds, 'other')
+				for upd in node.upds:
+					add (upd, 'other')
+					add_expr (upd[1])
+			elif node.kind == 'Call':
+				add (node.args, 'other')
+				add (node.rets, 'other')
+				for v in node.args:
+					add_expr (v)
+			elif node.kind == 'Cond':
+				add_expr (node.cond)
+	lines = ['%d functions, %d nodes, %d distinct expressions'
+		% (len (functions), counts['Node'][0], counts['Expr'][0])]
+	for kind in ['Node', 'Expr', 'other']:
+		(n, size) = counts[kind]
+		lines.append ('  %-6s %9d objects %11d bytes (%.1f per object)'
+			% (kind, n, size, size * 1.0 / max (n, 1)))
+	n = max (counts['Node'][0], 1)
+	total = sum ([size for (_, size) in counts.itervalues ()])
+	lines.append ('  %d bytes, %.1f bytes per node' % (total,
+		total * 1.0 / n))
+	try:
+		import resource
+		rss = resource.getrusage (resource.RUSAGE_SELF).ru_maxrss
+		lines.append ('  peak resident set %d KiB' % rss)
+	except ImportError:
+		pass
+	return lines
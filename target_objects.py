@@ -23,6 +23,8 @@ structs = {}
 functions = {}
 functions_by_tag = {}
 const_globals = {}
+# the files the functions were loaded from, in order
+function_files = []
 
 symbols = {}
 sections = {}
@@ -72,10 +74,126 @@ tracer = [default_tracer]
 def trace (s, push = 0):
 	tracer[0](str (s), push)
 
-def load_target (target, target_args = None):
+# with the 'snapshot' target argument (target:snapshot), the objects built
+# by the target from its input files (by parsing, pseudo-compiling and so
+# on) are saved in a snapshot in the target directory, and are loaded from
+# it by later runs if the input files (and the code that built the objects)
+# are unchanged. see save_snapshot. snapshots are off by default, since a
+# snapshot is only as good as the hashes in its header.
+snapshots = [False]
+snapshot_name = ['target.snapshot']
+snapshot_loaded = [False]
+snapshot_format = 1
+
+snapshot_modules = ['target_objects', 'syntax', 'pseudo_compile',
+	'objdump', 'logic']
+
+def snapshot_path ():
+	if not snapshots[0] or not snapshot_name[0] or not target_dir.d:
+		return None
+	import os.path
+	return os.path.join (target_dir.d, snapshot_name[0])
+
+def file_hash (fname):
+	import hashlib
+	h = hashlib.sha1 ()
+	f = open (fname, 'rb')
+	while True:
+		chunk = f.read (1 << 20)
+		if not chunk:
+			break
+		h.update (chunk)
+	f.close ()
+	return h.hexdigest ()
+
+def snapshot_header (inputs):
+	"""a description of the inputs the objects are built from: the
+	contents of the named input files and of the modules that build
+	them, and the python version (hashes are kept in the objects)."""
+	import sys
+	import os.path
+	files = [os.path.join (target_dir.d, fname)
+		for fname in inputs + ['target.py']]
+	src_dir = os.path.dirname (os.path.abspath (__file__))
+	files.extend ([os.path.join (src_dir, m + '.py')
+		for m in snapshot_modules])
+	return {'format': snapshot_format, 'python': sys.version,
+		'hash_randomization': sys.flags.hash_randomization,
+		'inputs': inputs,
+		'hashes': [(fname, file_hash (fname)) for fname in files]}
+
+def snapshot_objects ():
+	import syntax
+	return {'structs': structs, 'functions': functions,
+		'functions_by_tag': functions_by_tag,
+		'const_globals': const_globals, 'symbols': symbols,
+		'sections': sections, 'rodata': rodata,
+		'global_wrappers': syntax.global_wrappers}
+
+def save_snapshot (inputs):
+	"""save the objects the target has built from the input files
+	(named relative to the target directory) for later runs."""
+	path = snapshot_path ()
+	if path == None:
+		return
+	if not all ([f.is_loaded () for f in functions.itervalues ()]):
+		# the functions are being loaded lazily from the inputs
+		return
+	import os
+	import cPickle
+	tmp = '%s.%d' % (path, os.getpid ())
+	try:
+		f = open (tmp, 'wb')
+		cPickle.dump (snapshot_header (inputs), f, 2)
+		cPickle.dump (snapshot_objects (), f, 2)
+		f.close ()
+		# the rename is atomic, so other processes see all or nothing
+		os.rename (tmp, path)
+	except (IOError, OSError, RuntimeError, cPickle.PicklingError), e:
+		trace ('Could not save target snapshot %s: %s' % (path, e))
+		if os.path.exists (tmp):
+			os.unlink (tmp)
+
+def load_snapshot ():
+	"""load the objects from the target's snapshot, if there is one
+	and it was built from the current input files."""
+	path = snapshot_path ()
+	import os.path
+	if path == None or not os.path.exists (path):
+		return False
+	import cPickle
+	f = open (path, 'rb')
+	try:
+		header = cPickle.load (f)
+		if (type (header) != dict or header.get ('format')
+				!= snapshot_format):
+			return False
+		if header != snapshot_header (header['inputs']):
+			trace ('Target snapshot %s is out of date.' % path)
+			return False
+		objs = cPickle.load (f)
+	except (IOError, OSError, EOFError, cPickle.UnpicklingError), e:
+		trace ('Could not load target snapshot %s: %s' % (path, e))
+		return False
+	finally:
+		f.close ()
+	import syntax
+	for (name, v) in objs.iteritems ():
+		if name == 'rodata':
+			rodata[:] = v
+		elif name == 'global_wrappers':
+			syntax.global_wrappers.update (v)
+		else:
+			globals ()[name].update (v)
+	snapshot_loaded[0] = True
+	return True
+
+def load_target (target, t_args = None):
 	target_dir.set_dir (target)
-	if target_args != None:
-		target_args.extend (target_args)
+	if t_args != None:
+		target_args.extend (t_args)
+	if 'snapshot' in target_args:
+		snapshots[0] = True
 	package = '.'.join (__name__.split ('.')[:-1])
 	import sys
 	if package:
@@ -83,6 +201,7 @@ def load_target (target, target_args = None):
 		pck.__path__.append (target)
 	else:
 		sys.path.append (target)
+	load_snapshot ()
 	import target
 
 def load_target_args (args = None):